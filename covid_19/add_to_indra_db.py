@@ -1,12 +1,19 @@
+import os
+import time
 import logging
+import argparse
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from indra.util import batch_iter
 from indra_db.util import get_db
 from indra_db.util.data_gatherer import DataGatherer, DGContext
 from indra_db.cli.content import ContentManager, logger as content_logger
-from covid_19.get_indra_stmts import get_metadata_dict
-from covid_19.preprocess import get_text_refs_from_metadata, \
-    get_zip_texts_for_entry, download_latest_data, get_all_texts
+from covid_19.metadata import get_metadata_table
+from covid_19.release_diff import diff_releases, filter_metadata_to_diff
+from covid_19.preprocess import get_text_refs_for_entries, \
+    get_zip_texts_for_entry, download_latest_data, get_all_texts, \
+    set_release_date, build_text_index, TextIndex, zip_texts, get_basepath, \
+    get_json_filenames_for_entry
 from indra_db.databases import sql_expressions as sql_exp
 
 
@@ -19,27 +26,83 @@ content_logger.setLevel(logging.DEBUG)
 gatherer = DataGatherer('content', ['refs', 'content'])
 
 
+def _filter_existing_tc_records(tc_records, existing_tc_records):
+    """Return the set of content records not already on the database.
+
+    Parameters
+    ----------
+    tc_records : iterable of tuple
+        Text content records of TextRef ID, source, format, text type and
+        content.
+    existing_tc_records : set of tuple
+        The (TextRef ID, source, format, text type) tuples of the content
+        already on the database.
+
+    Returns
+    -------
+    set of tuple
+        The deduplicated records whose content is not on the database.
+    """
+    return {rec for rec in tc_records if rec[:-1] not in existing_tc_records}
+
+
 class Cord19Manager(ContentManager):
     tr_cols = ('pmid', 'pmcid', 'doi')
     my_source = 'cord19'
     primary_col = 'pmid'
 
-    def __init__(self, cord_md):
+    def __init__(self, cord_md, n_proc=None, load_content=True,
+                 compress_proc=None, compress_level=None, update_uids=None):
         self.cord_md = cord_md
+        # The cord_uids of documents whose existing content is replaced
+        self.update_uids = set(update_uids) if update_uids else set()
+        self.n_proc = n_proc
+        self.compress_proc = compress_proc
+        self.compress_level = compress_level
         self.tr_data = []
         self.tc_data = []
         self.tc_cols = ('text_ref_id', 'source', 'format', 'text_type',
                         'content',)
         self.review_fname = 'cord19_mgr_review.txt'
 
-        texts_by_file = get_all_texts()
+        # In streaming mode, content is loaded batch by batch in
+        # populate_streaming instead
+        if not load_content:
+            return
+        texts_by_file = get_all_texts(n_proc=n_proc)
+        self.tr_data, self.tc_data = \
+            self.get_data_for_entries(cord_md, texts_by_file)
+
+    @staticmethod
+    def get_data_for_entries(md_entries, texts_by_file):
+        """Return text ref and text content data for metadata entries.
+
+        Parameters
+        ----------
+        md_entries : list of dict
+            CORD19 metadata entries.
+        texts_by_file : dict or TextIndex
+            A mapping of json filenames to full texts.
+
+        Returns
+        -------
+        tr_data : list of dict
+            Text ref entries keyed by pmid, pmcid, doi and cord_uid.
+        tc_data : list of dict
+            Text content entries keyed by source, format, text_type and
+            (uncompressed) content, in addition to the text ref IDs.
+        """
+        tr_data = []
+        tc_data = []
         # Get tr_data list from Cord19 metadata
         # tr_data is a list [{'pmid': xxx, 'pmcid': xxx}, {...}]
         # tc_data is a list of dictionaries keyed by column name (???)
-        for ix, md_entry in enumerate(cord_md):
+        all_text_refs = get_text_refs_for_entries(md_entries)
+        for ix, (md_entry, text_refs) in enumerate(zip(md_entries,
+                                                       all_text_refs)):
             if ix % 10000 == 0:
-                print(f"Processing CORD-19 full texts: {ix} of {len(cord_md)}")
-            text_refs = get_text_refs_from_metadata(md_entry)
+                print(f"Processing CORD-19 full texts: {ix} of "
+                      f"{len(md_entries)}")
             doi = text_refs.get('DOI')
             if doi is not None:
                 doi = doi.upper()
@@ -48,22 +111,29 @@ class Cord19Manager(ContentManager):
                              'doi': doi,
                              'cord_uid': text_refs.get('CORD19_UID')}
             # If has abstract, add TC entry with abstract content
-            tc_texts = get_zip_texts_for_entry(md_entry, texts_by_file)
+            # Texts are compressed later, see _populate_data
+            tc_texts = get_zip_texts_for_entry(md_entry, texts_by_file,
+                                               zip=False)
             for source, text_type, text in tc_texts:
                 tc_data_entry = {'source': source,
                                  'format': 'text',
                                  'text_type': text_type,
                                  'content': text}
                 tc_data_entry.update(tr_data_entry)
-                self.tc_data.append(tc_data_entry)
-            self.tr_data.append(tr_data_entry)
-
+                tc_data.append(tc_data_entry)
+            tr_data.append(tr_data_entry)
+        return tr_data, tc_data
 
     def filter_text_content(self, db, tc_data):
         """Link Text Content entries to corresponding Text Refs and filter
-        out entries already in the database."""
+        out entries already in the database.
+
+        Returns the records to add, the flawed entries and the updates of
+        existing content of documents in update_uids, as dicts with the
+        TextContent id and the new content.
+        """
         if not len(tc_data):
-            return []
+            return [], set(), []
         logger.info("Beginning to filter text content...")
         tr_list = []
         # Step 1: Build a dictionary matching IDs to text ref objects
@@ -101,9 +171,12 @@ class Cord19Manager(ContentManager):
         # text_type
         flawed_tcs = set()
         tc_data_by_tr = []
+        # TextRef IDs of the content, partitioned by source as we go
+        trids_by_source = defaultdict(set)
         for tc_entry in tc_data:
             by_tr_entry = {}
-            for field in ('source', 'format', 'text_type', 'content'):
+            for field in ('source', 'format', 'text_type', 'content',
+                          'cord_uid'):
                 by_tr_entry[field] = tc_entry[field]
             tr_ids_for_tc = set()
             for id_type, trs_by_id in (('pmid', trs_by_pmid),
@@ -133,53 +206,242 @@ class Cord19Manager(ContentManager):
                 tr_id = list(tr_ids_for_tc)[0]
                 by_tr_entry['trid'] = tr_id
                 tc_data_by_tr.append(by_tr_entry)
+                trids_by_source[by_tr_entry['source']].add(tr_id)
 
         # Step 2: Get existing Text Content objects corresponding to the
         # the given text refs with the same format and source.
         # This should be a very small list, in general.
-        existing_tc_records = []
+        existing_tc_records = set()
+        # The IDs of the existing content, to update content by ID
+        existing_tc_ids = {}
         for source, text_type in (('cord19_abstract', 'abstract'),
                                   ('cord19_pmc_xml', 'fulltext'),
                                   ('cord19_pdf', 'fulltext')):
             logger.debug('Finding existing text content from db for '
                          'source type %s' % source)
-            tc_by_source = [tc_entry for tc_entry in tc_data_by_tr
-                                     if tc_entry['source'] == source]
+            if not trids_by_source[source]:
+                continue
             existing_tcs = db.select_all(
                 db.TextContent,
-                db.TextContent.text_ref_id.in_([
-                                tc['trid'] for tc in tc_by_source]),
+                db.TextContent.text_ref_id.in_(
+                    list(trids_by_source[source])),
                 db.TextContent.source == source,
                 db.TextContent.format == 'text',
                 db.TextContent.text_type == text_type
             )
-            # Reformat Text Content objects to list of tuples
-            existing_tc_records += [
-                (tc.text_ref_id, tc.source, tc.format, tc.text_type)
-                for tc in existing_tcs
-                ]
+            # Reformat Text Content objects to a set of tuples
+            for tc in existing_tcs:
+                tc_key = (tc.text_ref_id, tc.source, tc.format, tc.text_type)
+                existing_tc_records.add(tc_key)
+                existing_tc_ids[tc_key] = tc.id
             logger.debug("Found %d existing records on the db for %s." %
                          (len(existing_tc_records), source))
-        # Convert list of dicts into a list of tuples
-        tc_records = []
-        for tc_entry in tc_data_by_tr:
-            tc_records.append((tc_entry['trid'], tc_entry['source'],
-                               tc_entry['format'], tc_entry['text_type'],
-                               tc_entry['content']))
-
-        # Filter the TC records to exclude
-        filtered_tc_records = [
-           rec for rec in tc_records if rec[:-1] not in existing_tc_records
-        ]
+        # Convert list of dicts into a set of tuples, filtering out the
+        # records already on the db
+        filtered_tc_records = _filter_existing_tc_records(
+            ((tc_entry['trid'], tc_entry['source'], tc_entry['format'],
+              tc_entry['text_type'], tc_entry['content'])
+             for tc_entry in tc_data_by_tr),
+            existing_tc_records)
+        # Content of changed documents that is already on the db is
+        # replaced rather than skipped
+        tc_updates = {}
+        if self.update_uids:
+            for tc_entry in tc_data_by_tr:
+                if tc_entry['cord_uid'] not in self.update_uids:
+                    continue
+                tc_id = existing_tc_ids.get(
+                    (tc_entry['trid'], tc_entry['source'],
+                     tc_entry['format'], tc_entry['text_type']))
+                if tc_id is not None:
+                    tc_updates[tc_id] = {'id': tc_id,
+                                         'content': tc_entry['content']}
         logger.info("Finished filtering the text content.")
-        return list(set(filtered_tc_records)), flawed_tcs
+        return list(filtered_tc_records), flawed_tcs, \
+            list(tc_updates.values())
+
+    def update_text_content(self, db, tc_updates, batch_size=1000):
+        """Replace the content of existing Text Content entries.
+
+        Parameters
+        ----------
+        db : indra_db.DatabaseManager
+            The database to update.
+        tc_updates : list of dict
+            The TextContent id and the new (compressed) content of each
+            entry to update.
+        batch_size : Optional[int]
+            The number of entries updated per transaction. Default: 1000
+        """
+        for tc_batch in batch_iter(tc_updates, batch_size):
+            db.session.bulk_update_mappings(db.TextContent, list(tc_batch))
+            db.session.commit()
 
     @ContentManager._record_for_review
     @DGContext.wrap(gatherer)
     def populate(self, db):
+        return self._populate_data(db, self.tr_data, self.tc_data)
+
+    @ContentManager._record_for_review
+    @DGContext.wrap(gatherer)
+    def populate_streaming(self, db, batch_size=5000, progress_file=None,
+                           index_entries_only=False):
+        """Add text refs and content to the DB in batches of metadata entries.
+
+        Texts are looked up in the on-disk text index and compressed batch
+        by batch, so memory use is bounded by the batch size. The row
+        indices and cord_uids of each batch are appended to the progress
+        file once the batch is uploaded, and rows in the progress file are
+        skipped, so that an interrupted run can be resumed. Rows are only
+        skipped if both the index and the cord_uid match, so rows with
+        duplicate cord_uids are all processed.
+
+        Parameters
+        ----------
+        db : indra_db.DatabaseManager
+            The database to add content to.
+        batch_size : Optional[int]
+            The number of metadata entries per batch. Default: 5000
+        progress_file : Optional[str]
+            The file to record completed rows in. Default:
+            cord19_mgr_progress.txt in the data directory of the release
+        index_entries_only : Optional[bool]
+            If True, only the json files of the entries still to add are
+            indexed rather than the whole tarball, e.g. when adding the
+            documents of a release diff. Default: False
+
+        Returns
+        -------
+        dict
+            The number of text refs and content entries added and the
+            number of batches processed.
+        """
+        if progress_file is None:
+            progress_file = os.path.join(get_basepath(),
+                                         'cord19_mgr_progress.txt')
+        done_rows = set()
+        if os.path.exists(progress_file):
+            with open(progress_file, 'r') as fh:
+                for line in fh:
+                    row_ix, cord_uid = line.rstrip('\n').split('\t', 1)
+                    done_rows.add((int(row_ix), cord_uid))
+            logger.info('Resuming, skipping %d completed entries'
+                        % len(done_rows))
+        rows_todo = [(row_ix, md_entry) for row_ix, md_entry
+                     in enumerate(self.cord_md)
+                     if (row_ix, md_entry['cord_uid']) not in done_rows]
+        if index_entries_only:
+            filenames = {fname for _, md_entry in rows_todo
+                         for fname in get_json_filenames_for_entry(md_entry)}
+            texts_by_file = TextIndex(build_text_index(n_proc=self.n_proc,
+                                                       filenames=filenames))
+        else:
+            texts_by_file = TextIndex(build_text_index(n_proc=self.n_proc))
+        # A single compression pool is shared by all batches
+        executor = self._get_compress_executor()
+        summary = {'refs': 0, 'content': 0, 'updated_content': 0,
+                   'batches': 0,
+                   'compression': defaultdict(float)}
+        try:
+            for ix, row_batch in enumerate(batch_iter(rows_todo,
+                                                      batch_size)):
+                row_batch = list(row_batch)
+                md_batch = [md_entry for _, md_entry in row_batch]
+                logger.info('Processing batch %d of %d entries'
+                            % (ix, len(md_batch)))
+                tr_data, tc_data = self.get_data_for_entries(md_batch,
+                                                             texts_by_file)
+                res = self._populate_data_compressing(db, tr_data, tc_data,
+                                                      executor)
+                with open(progress_file, 'a') as fh:
+                    for row_ix, md_entry in row_batch:
+                        fh.write('%d\t%s\n' % (row_ix, md_entry['cord_uid']))
+                summary['refs'] += len(res['filtered_tr_records'])
+                summary['content'] += len(res['filtered_tc_records'])
+                summary['updated_content'] += len(res['tc_updates'])
+                summary['batches'] += 1
+                for key, val in res['compression'].items():
+                    summary['compression'][key] += val
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            texts_by_file.close()
+        compression = summary['compression']
+        # Overall throughput rather than the sum over batches
+        compression['mb_per_second'] = \
+            (compression['chars_in'] / 1e6 / compression['wall_seconds']
+             if compression['wall_seconds'] else 0)
+        summary['compression'] = dict(compression)
+        logger.info('Added %d text refs and %d text content entries and '
+                    'updated %d text content entries in %d batches.'
+                    % (summary['refs'], summary['content'],
+                       summary['updated_content'], summary['batches']))
+        return summary
+
+    def _compress_content(self, tc_data, executor=None):
+        """Compress the content of text content entries, possibly in a pool.
+
+        Returns a function that waits for the compression to finish, sets
+        the compressed content on the entries and returns statistics on the
+        compression throughput.
+        """
+        ts = time.time()
+        texts = [tc['content'] for tc in tc_data]
+        if executor is None:
+            results = [zip_texts(texts, self.compress_level)]
+        else:
+            futures = [executor.submit(zip_texts, list(chunk),
+                                       self.compress_level)
+                       for chunk in batch_iter(texts, 100)]
+
+        def collect():
+            zipped = []
+            worker_time = 0
+            for res in (results if executor is None else
+                        (future.result() for future in futures)):
+                zipped += res[0]
+                worker_time += res[1]
+            wall_time = time.time() - ts
+            for tc, content in zip(tc_data, zipped):
+                tc['content'] = content
+            chars_in = sum(len(text) for text in texts)
+            stats = {'texts': len(texts),
+                     'chars_in': chars_in,
+                     'bytes_out': sum(len(content) for content in zipped),
+                     'worker_seconds': worker_time,
+                     'wall_seconds': wall_time,
+                     'mb_per_second': (chars_in / 1e6 / wall_time
+                                       if wall_time else 0)}
+            logger.info('Compressed %d texts (%.1f MB) in %.1fs (%.1f MB/s)'
+                        % (stats['texts'], chars_in / 1e6, wall_time,
+                           stats['mb_per_second']))
+            return stats
+        return collect
+
+    def _get_compress_executor(self):
+        """Return a process pool to compress content in, or None to
+        compress in this process."""
+        if self.compress_proc and self.compress_proc > 1:
+            return ProcessPoolExecutor(self.compress_proc)
+        return None
+
+    def _populate_data(self, db, tr_data, tc_data):
+        executor = self._get_compress_executor()
+        try:
+            return self._populate_data_compressing(db, tr_data, tc_data,
+                                                   executor)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def _populate_data_compressing(self, db, tr_data, tc_data,
+                                   executor=None):
+        # Compress the text content in worker processes while the text
+        # refs are looked up on the DB
+        collect_compressed = self._compress_content(tc_data, executor)
         # Turn the list of dicts into a set of tuples
         tr_data_set = {tuple([entry[id_type] for id_type in self.tr_cols])
-                       for entry in self.tr_data}
+                       for entry in tr_data}
         # Filter_text_refs will figure out which articles are already in the
         # TextRef table and will update them with any new metadata;
         # filtered_tr_records are the ones that need to be added to the DB
@@ -200,14 +462,16 @@ class Cord19Manager(ContentManager):
         #                  if cause in ['pmcid', 'over_match_input',
         #                               'over_match_db']}
 
+        compression_stats = collect_compressed()
+
         # Then we put together the updated text content data
         if len(trs_to_skip) != 0:
             mod_tc_data = [
-                tc for tc in self.tc_data
+                tc for tc in tc_data
                 if (tc.get('pmid'), tc.get('pmcid'), tc.get('doi'))
                                                     not in trs_to_skip]
         else:
-            mod_tc_data = self.tc_data
+            mod_tc_data = tc_data
 
         # Upload TextRef data for articles NOT already in the DB
         logger.info('Adding %d new text refs...' % len(filtered_tr_records))
@@ -216,7 +480,7 @@ class Cord19Manager(ContentManager):
         gatherer.add('refs', len(filtered_tr_records))
 
         # Process the text content data
-        filtered_tc_records, flawed_tcs = \
+        filtered_tc_records, flawed_tcs, tc_updates = \
                             self.filter_text_content(db, mod_tc_data)
 
         # Upload the text content data.
@@ -224,18 +488,61 @@ class Cord19Manager(ContentManager):
                     len(filtered_tc_records))
         self.upload_text_content(db, filtered_tc_records)
         gatherer.add('content', len(filtered_tc_records))
+
+        # Replace the content of changed documents already in the DB
+        if tc_updates:
+            logger.info('Updating %d existing text content entries...' %
+                        len(tc_updates))
+            self.update_text_content(db, tc_updates)
         return {'filtered_tr_records': filtered_tr_records,
                 'flawed_tr_records': flawed_tr_records,
                 'mod_tc_data': mod_tc_data,
-                'filtered_tc_records': filtered_tc_records}
+                'filtered_tc_records': filtered_tc_records,
+                'tc_updates': tc_updates,
+                'compression': compression_stats}
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description='Add CORD19 text refs and content to the INDRA DB.')
+    parser.add_argument('-r', '--release_date',
+                        help='CORD19 release date to use, e.g. 2020-06-15 '
+                             '(optional, default: latest release)',
+                        required=False)
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='Only add documents that were added or changed '
+                             'since the previous release available locally, '
+                             'replacing the content of changed documents')
+    parser.add_argument('-s', '--stream', action='store_true',
+                        help='Add content in batches of metadata entries '
+                             'with bounded memory, resuming from previous '
+                             'runs')
+    parser.add_argument('-b', '--batch_size', type=int, default=5000,
+                        help='Number of metadata entries per batch in '
+                             'streaming mode (default: 5000)')
+    parser.add_argument('-z', '--compress_level', type=int,
+                        help='gzip compression level (1-9) of the text '
+                             'content (default: that of zip_string)')
+    args = parser.parse_args()
+    set_release_date(args.release_date)
     download_latest_data()
-    md = get_metadata_dict()
+    md = get_metadata_table()
     md = [e for e in md if e['doi'] and
                            e['doi'].upper() != '0.1126/SCIENCE.ABB7331']
-    cm = Cord19Manager(md)
+    update_uids = None
+    if args.incremental:
+        release_diff = diff_releases()
+        md = filter_metadata_to_diff(md, release_diff)
+        update_uids = release_diff.changed
     db = get_db('primary')
-    res = cm.populate(db)
+    cm = Cord19Manager(md, n_proc=os.cpu_count(),
+                       load_content=not args.stream,
+                       compress_proc=os.cpu_count(),
+                       compress_level=args.compress_level,
+                       update_uids=update_uids)
+    if args.stream:
+        res = cm.populate_streaming(db, batch_size=args.batch_size,
+                                    index_entries_only=args.incremental)
+    else:
+        res = cm.populate(db)
 
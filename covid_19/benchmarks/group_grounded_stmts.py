@@ -0,0 +1,95 @@
+"""Benchmark emmaa_update.group_grounded_stmts against filtering the whole
+corpus with ac.filter_grounded_only and then grouping the result.
+
+Run as
+
+    python -m covid_19.benchmarks.group_grounded_stmts -n 1000000
+"""
+import time
+import random
+import argparse
+from indra.statements import Agent, BoundCondition, Evidence, \
+    Phosphorylation, Complex
+from indra.tools import assemble_corpus as ac
+from covid_19.emmaa_update import group_grounded_stmts
+
+
+def _agent(rng, name):
+    # About a fifth of the agents are ungrounded
+    db_refs = {'TEXT': name}
+    if rng.random() > 0.2:
+        db_refs['HGNC'] = str(rng.randint(1, 1000))
+    agent = Agent(name, db_refs=db_refs)
+    if rng.random() < 0.05:
+        agent.bound_conditions = [BoundCondition(_agent(rng, name + 'b'))]
+    return agent
+
+
+def get_stmts(n_stmts, n_trids, seed=0):
+    """Return synthetic raw statements with some ungrounded agents and
+    some evidences without a TRID."""
+    rng = random.Random(seed)
+    stmts = []
+    for ix in range(n_stmts):
+        trid = rng.randint(1, n_trids) if rng.random() > 0.05 else None
+        evidence = [Evidence(source_api='reach', text='text %d' % ix,
+                             text_refs={'TRID': trid} if trid else {})]
+        if rng.random() < 0.5:
+            stmt = Phosphorylation(_agent(rng, 'A%d' % ix),
+                                   _agent(rng, 'B%d' % ix),
+                                   evidence=evidence)
+        else:
+            stmt = Complex([_agent(rng, 'C%d' % ix), _agent(rng, 'D%d' % ix)],
+                           evidence=evidence)
+        stmts.append(stmt)
+    return stmts
+
+
+def group_two_pass(stmts):
+    """Filter and group statements in two passes over the whole corpus, as
+    done before group_grounded_stmts."""
+    by_tr = {}
+    no_tr = []
+    for stmt in ac.filter_grounded_only(stmts):
+        tr = stmt.evidence[0].text_refs.get('TRID')
+        if tr is None:
+            no_tr.append(stmt)
+        elif tr in by_tr:
+            by_tr[tr].append(stmt)
+        else:
+            by_tr[tr] = [stmt]
+    return by_tr, no_tr
+
+
+def _time(func, *args, **kwargs):
+    ts = time.perf_counter()
+    res = func(*args, **kwargs)
+    return res, time.perf_counter() - ts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark filtering and grouping statements by TextRef.')
+    parser.add_argument('-n', '--n-stmts', type=int, default=1000000)
+    parser.add_argument('--n-trids', type=int, default=50000)
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    parser.add_argument('--n-proc', type=int, nargs='*', default=[1, 4])
+    args = parser.parse_args()
+
+    stmts, t = _time(get_stmts, args.n_stmts, args.n_trids)
+    print('Built %d statements in %.1fs' % (len(stmts), t))
+    (by_tr, no_tr), t = _time(group_two_pass, stmts)
+    print('Two passes: %.1fs' % t)
+    expected = ({tr: [stmt.get_hash() for stmt in stmt_list]
+                 for tr, stmt_list in by_tr.items()},
+                [stmt.get_hash() for stmt in no_tr])
+    del by_tr, no_tr
+    for n_proc in args.n_proc:
+        (by_tr, no_tr), t = _time(group_grounded_stmts, iter(stmts),
+                                  n_proc=n_proc, chunk_size=args.chunk_size)
+        same = ({tr: [stmt.get_hash() for stmt in stmt_list]
+                 for tr, stmt_list in by_tr.items()},
+                [stmt.get_hash() for stmt in no_tr]) == expected
+        print('group_grounded_stmts, n_proc=%d: %.1fs, same result: %s'
+              % (n_proc, t, same))
+        del by_tr, no_tr
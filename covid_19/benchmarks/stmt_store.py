@@ -0,0 +1,75 @@
+"""Benchmark the statement store against pickles and indented JSON, the
+formats combine_all_stmts wrote before.
+
+Run as
+
+    python -m covid_19.benchmarks.stmt_store -n 100000
+"""
+import os
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from indra.statements import stmts_from_json, stmts_to_json
+from indra.tools import assemble_corpus as ac
+from covid_19 import stmt_store
+from covid_19.benchmarks.group_grounded_stmts import get_stmts
+
+
+def dump_json(stmts, fname):
+    with open(fname, 'wt') as fh:
+        json.dump(stmts_to_json(stmts), fh, indent=2)
+
+
+def load_json(fname):
+    with open(fname, 'rt') as fh:
+        return stmts_from_json(json.load(fh))
+
+
+formats = {
+    'pickle': ('pkl', ac.dump_statements, ac.load_statements),
+    'json indent=2': ('json', dump_json, load_json),
+    'store': ('stmts', stmt_store.dump_statements,
+              stmt_store.load_statements),
+}
+
+
+def _time(func, *args):
+    ts = time.perf_counter()
+    res = func(*args)
+    return res, time.perf_counter() - ts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark statement file formats.')
+    parser.add_argument('-n', '--n-stmts', type=int, default=100000)
+    parser.add_argument('--n-lookups', type=int, default=100)
+    args = parser.parse_args()
+
+    stmts = get_stmts(args.n_stmts, args.n_stmts // 20)
+    hashes = [stmt.get_hash() for stmt in stmts]
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        print('%-15s %8s %8s %10s' % ('format', 'dump', 'load', 'size'))
+        for name, (ext, dump, load) in formats.items():
+            fname = os.path.join(tmp_dir, 'stmts.%s' % ext)
+            _, dump_time = _time(dump, stmts, fname)
+            loaded, load_time = _time(load, fname)
+            assert [stmt.get_hash() for stmt in loaded] == hashes
+            print('%-15s %7.1fs %7.1fs %7.1f MB'
+                  % (name, dump_time, load_time,
+                     os.path.getsize(fname) / 1e6))
+        lookup_hashes = random.Random(0).sample(
+            hashes, min(args.n_lookups, len(hashes)))
+        with stmt_store.StatementStore(
+                os.path.join(tmp_dir, 'stmts.stmts')) as store:
+            ts = time.perf_counter()
+            for stmt_hash in lookup_hashes:
+                store.get(stmt_hash)
+            print('store lookup by hash: %.1f ms'
+                  % (1000 * (time.perf_counter() - ts) / len(lookup_hashes)))
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,197 @@
+"""Resumable, parallel downloads of large CORD19 release files.
+
+Files are downloaded into a partial file using several concurrent HTTP
+Range requests. The progress of each segment is recorded in a small state
+file so that an interrupted download can be resumed, and the partial file
+is only renamed to its final name once every segment was downloaded.
+"""
+import os
+import json
+import logging
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadError(Exception):
+    pass
+
+
+def get_remote_info(url):
+    """Return the size, ETag and range support of a remote file.
+
+    Parameters
+    ----------
+    url : str
+        The URL of the file.
+
+    Returns
+    -------
+    dict
+        A dictionary with keys size (int or None), etag (str or None) and
+        ranges (bool).
+    """
+    req = urllib.request.Request(url, method='HEAD')
+    with urllib.request.urlopen(req) as response:
+        headers = response.headers
+    size = headers.get('Content-Length')
+    return {'size': int(size) if size is not None else None,
+            'etag': headers.get('ETag'),
+            'ranges': headers.get('Accept-Ranges', '').lower() == 'bytes'}
+
+
+def _get_segments(size, n_segments):
+    segment_size = -(-size // n_segments)
+    return [[start, min(start + segment_size, size) - 1, start]
+            for start in range(0, size, segment_size)]
+
+
+def _load_state(state_file, info):
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file, 'r') as fh:
+        state = json.load(fh)
+    # Only resume if the remote file is the same as when we started
+    if state.get('size') != info['size'] or \
+            state.get('etag') != info['etag']:
+        logger.info('Remote file changed, restarting download')
+        return None
+    return state
+
+
+def _download_segment(url, part_file, segment, state, lock, state_file,
+                      etag, chunk_size, state_interval):
+    start, end, pos = segment
+    if pos > end:
+        return
+    req = urllib.request.Request(url,
+                                 headers={'Range': 'bytes=%d-%d' % (pos, end)})
+    if etag:
+        req.add_header('If-Range', etag)
+    try:
+        with urllib.request.urlopen(req) as response, \
+                open(part_file, 'r+b') as fh:
+            if response.status != 206:
+                raise DownloadError('Server did not return a partial '
+                                    'response for %s' % url)
+            fh.seek(pos)
+            saved_pos = pos
+            while pos <= end:
+                chunk = response.read(min(chunk_size, end - pos + 1))
+                if not chunk:
+                    break
+                fh.write(chunk)
+                pos += len(chunk)
+                if pos - saved_pos >= state_interval:
+                    # Only record progress that is in the file
+                    fh.flush()
+                    with lock:
+                        segment[2] = pos
+                        _dump_state(state_file, state)
+                    saved_pos = pos
+    finally:
+        # Record the progress of the segment when it ends or fails, the file
+        # is closed and flushed by now
+        with lock:
+            segment[2] = pos
+            _dump_state(state_file, state)
+    if pos <= end:
+        raise DownloadError('Segment %d-%d of %s is incomplete'
+                            % (start, end, url))
+
+
+def _dump_state(state_file, state):
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'w') as fh:
+        json.dump(state, fh)
+    os.replace(tmp_file, state_file)
+
+
+def _download_stream(url, part_file, chunk_size):
+    n_bytes = 0
+    with urllib.request.urlopen(url) as response, \
+            open(part_file, 'wb') as fh:
+        while True:
+            chunk = response.read(chunk_size)
+            if not chunk:
+                break
+            fh.write(chunk)
+            n_bytes += len(chunk)
+    return n_bytes
+
+
+def download_file(url, path, n_segments=4, chunk_size=1024 * 1024,
+                  state_interval=8 * 1024 * 1024):
+    """Download a file with resume support and concurrent segments.
+
+    The file is written to path + '.part' and atomically renamed to path
+    once complete, so a file at path is never truncated. If a previous
+    download of the same remote file (same size and ETag) was interrupted,
+    only the missing parts are downloaded.
+
+    Parameters
+    ----------
+    url : str
+        The URL of the file to download.
+    path : str
+        The path to save the file to.
+    n_segments : Optional[int]
+        The number of segments to download concurrently. Default: 4
+    chunk_size : Optional[int]
+        The number of bytes read at a time from each response.
+        Default: 1 MB
+    state_interval : Optional[int]
+        The number of bytes downloaded in a segment after which its
+        progress is recorded. Progress is also recorded when a segment
+        completes or fails, so at most this many bytes per segment are
+        downloaded again if the process is killed. Default: 8 MB
+
+    Returns
+    -------
+    str
+        The path to the downloaded file.
+    """
+    part_file = path + '.part'
+    state_file = path + '.part.json'
+    info = get_remote_info(url)
+    if not info['ranges'] or not info['size']:
+        logger.info('Server does not support range requests, downloading '
+                    '%s in a single stream' % url)
+        n_bytes = _download_stream(url, part_file, chunk_size)
+        if info['size'] is not None and n_bytes != info['size']:
+            raise DownloadError('Downloaded %d bytes of %s, expected %d'
+                                % (n_bytes, url, info['size']))
+    else:
+        state = _load_state(state_file, info)
+        if state is None or not os.path.exists(part_file):
+            state = {'size': info['size'], 'etag': info['etag'],
+                     'segments': _get_segments(info['size'], n_segments)}
+            with open(part_file, 'wb') as fh:
+                fh.truncate(info['size'])
+            _dump_state(state_file, state)
+        else:
+            logger.info('Resuming download of %s' % url)
+        lock = threading.Lock()
+        with ThreadPoolExecutor(max_workers=n_segments) as executor:
+            futures = [executor.submit(_download_segment, url, part_file,
+                                       segment, state, lock, state_file,
+                                       info['etag'], chunk_size,
+                                       state_interval)
+                       for segment in state['segments']]
+            for future in futures:
+                future.result()
+        # The part file has the full size from the start, so check that
+        # every segment was downloaded rather than the size of the file
+        incomplete = [(start, end) for start, end, pos in state['segments']
+                      if pos <= end]
+        if incomplete:
+            raise DownloadError('Segments %s of %s are incomplete'
+                                % (incomplete, url))
+    os.replace(part_file, path)
+    if os.path.exists(state_file):
+        os.remove(state_file)
+    logger.info('Downloaded %s to %s' % (url, path))
+    return path
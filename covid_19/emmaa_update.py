@@ -1,41 +1,163 @@
-import pickle
+import os
+import gzip
+import json
 import argparse
 import logging
-from copy import copy
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from indra.util import batch_iter
 from indra.tools import assemble_corpus as ac
+from covid_19 import stmt_store
+from covid_19.model_index import get_model_index_file, build_model_index, \
+    update_model_index, save_model_index, load_model_index
+from covid_19.model_snapshot import load_model_stmts
 from covid_19.get_indra_stmts import get_tr_dicts_and_ids, get_raw_stmts
+from covid_19.preprocess import set_release_date
+from covid_19.release_diff import diff_releases
 
 
 logger = logging.getLogger(__name__)
 
 
-def stmts_by_text_refs(stmt_list):
+def _group_grounded_chunk(stmts):
+    grounded = ac.filter_grounded_only(stmts)
     by_tr = {}
     no_tr = []
-    for stmt in stmt_list:
-        #if len(stmt.evidence) > 1:
-        #    raise ValueError('Statement has more than 1 evidence; '
-        #                     'pass raw stmts')
-        tr = stmt.evidence[0].text_refs.get('TRID')
+    for stmt in grounded:
+        tr = stmt.evidence[0].text_refs.get('TRID') if stmt.evidence \
+            else None
         if tr is None:
             no_tr.append(stmt)
+        elif tr in by_tr:
+            by_tr[tr].append(stmt)
         else:
+            by_tr[tr] = [stmt]
+    return by_tr, no_tr, len(stmts) - len(grounded)
+
+
+def _iter_grouped_chunks(stmts, n_proc, chunk_size):
+    # Group chunks in a process pool with a bounded number of chunks in
+    # flight, and return results in the order of the chunks
+    max_pending = 2 * n_proc
+    with ProcessPoolExecutor(max_workers=n_proc) as executor:
+        pending = deque()
+        for chunk in batch_iter(stmts, chunk_size, list):
+            pending.append(executor.submit(_group_grounded_chunk, chunk))
+            while len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def group_grounded_stmts(stmts, n_proc=None, chunk_size=50000):
+    """Filter statements to grounded ones and group them by TextRef.
+
+    Statements are filtered with ac.filter_grounded_only one chunk at a
+    time and grouped by the TRID of their first evidence, so that only one
+    chunk of the input is held in memory besides the result.
+
+    Parameters
+    ----------
+    stmts : iterable of indra.statements.Statement
+        The statements to filter and group, e.g. a list or an iterator over
+        a statement store.
+    n_proc : Optional[int]
+        If larger than 1, chunks of statements are filtered and grouped in
+        this many processes. This only pays off if checking the statements
+        costs more than sending them to the processes. Default: None
+    chunk_size : Optional[int]
+        The number of statements in a chunk filtered at a time, or sent to
+        a process. Default: 50000
+
+    Returns
+    -------
+    by_tr : dict
+        Lists of grounded statements keyed by the TRID of their first
+        evidence, in the order of the input.
+    no_tr : list[indra.statements.Statement]
+        Grounded statements without a TRID.
+    """
+    if n_proc and n_proc > 1:
+        chunk_results = _iter_grouped_chunks(stmts, n_proc, chunk_size)
+    else:
+        chunk_results = (_group_grounded_chunk(chunk) for chunk
+                         in batch_iter(stmts, chunk_size, list))
+    by_tr = {}
+    no_tr = []
+    n_ungrounded = 0
+    for chunk_by_tr, chunk_no_tr, chunk_n_ungrounded in chunk_results:
+        for tr, stmt_list in chunk_by_tr.items():
             if tr in by_tr:
-                by_tr[tr].append(stmt)
+                by_tr[tr] += stmt_list
             else:
-                by_tr[tr] = [stmt]
+                by_tr[tr] = stmt_list
+        no_tr += chunk_no_tr
+        n_ungrounded += chunk_n_ungrounded
+    logger.info('Grouped %d grounded statements by %d TextRefs, filtered out '
+                '%d ungrounded statements'
+                % (sum(len(v) for v in by_tr.values()) + len(no_tr),
+                   len(by_tr), n_ungrounded))
     return by_tr, no_tr
 
 
-def combine_stmts(new_cord_by_tr, old_model_by_tr):
-    stmts_copy = copy(new_cord_by_tr)
-    for trid, stmts in old_model_by_tr.items():
-        if trid not in stmts_copy:
-            stmts_copy[trid] = stmts
-    return stmts_copy
+def iter_stmts_from_file(fname):
+    """Iterate over the statements in a statement store or pickle file.
+
+    Statement stores are read one block at a time, pickle files have to be
+    loaded fully.
+    """
+    if stmt_store.is_store_file(fname):
+        with stmt_store.StatementStore(fname) as store:
+            yield from store
+    else:
+        yield from stmt_store.load_statements(fname)
+
+
+def stream_merge_stmts(stmt_iters, output_file):
+    """Write statements from several sources into a statement store.
+
+    The output is a statement store, not a pickle, so it has to be read with
+    covid_19.stmt_store.load_statements rather than ac.load_statements.
+
+    Statements are deduplicated by their full hash (including evidence)
+    so that only the set of hashes seen is kept in memory besides the
+    source currently being read.
+
+    Parameters
+    ----------
+    stmt_iters : list of iterable of indra.statements.Statement
+        The sources of statements, which are removed from the list one
+        after the other as they are consumed, so that each can be freed.
+    output_file : str
+        The path of the statement store to write, which can't end in .pkl.
+
+    Returns
+    -------
+    int
+        The number of statements written.
+    """
+    if output_file.endswith('.pkl'):
+        raise ValueError('A statement store can\'t be written to %s, use a '
+                         '.stmts extension' % output_file)
+    seen_hashes = set()
+    n_dups = 0
+    with stmt_store.StatementStoreWriter(output_file) as writer:
+        while stmt_iters:
+            for stmt in stmt_iters.pop(0):
+                stmt_hash = stmt.get_hash(shallow=False)
+                if stmt_hash in seen_hashes:
+                    n_dups += 1
+                    continue
+                seen_hashes.add(stmt_hash)
+                writer.write(stmt)
+    logger.info('Wrote %d statements to %s, skipped %d duplicates'
+                % (writer.count, output_file, n_dups))
+    return writer.count
 
 
-def make_model_stmts(old_model_stmts, new_cord_stmts=None, date_limit=5):
+def make_model_stmts(old_model_stmts, new_cord_stmts=None, date_limit=5,
+                     release_diff=None, n_threads=None, model_index=None,
+                     n_proc=None, use_cache=True):
     """Process and combine statements from different resources.
 
     Parameters
@@ -49,6 +171,26 @@ def make_model_stmts(old_model_stmts, new_cord_stmts=None, date_limit=5):
     date_limit : Optional[int]
         How many days back to search the database for CORD19 statements.
         Default: 5.
+    release_diff : Optional[covid_19.release_diff.ReleaseDiff]
+        If provided, statements are also pulled from the database for
+        TextRefs of CORD19 documents that changed in this release diff even
+        if they are part of the old model, and replace their statements in
+        the old model.
+    n_threads : Optional[int]
+        If larger than 1, the statements are pulled from the database in
+        this many concurrent chunk queries. Default: None
+    model_index : Optional[dict]
+        An index of old_model_stmts from build_model_index or
+        load_model_index, which is updated in place with the new statements
+        to index the returned statements. If not provided, it is built from
+        old_model_stmts.
+    n_proc : Optional[int]
+        If larger than 1, the new statements are filtered to grounded ones
+        and grouped by TextRef in this many processes. Default: None
+    use_cache : Optional[bool]
+        If True, TextRefs of CORD19 documents are resolved using the on-disk
+        TextRef cache, otherwise all of them are looked up in the DB.
+        Default: True
 
     Returns
     -------
@@ -57,48 +199,51 @@ def make_model_stmts(old_model_stmts, new_cord_stmts=None, date_limit=5):
     paper_ids : list[str]
         A list of TRIDs associated with statements.
     """
+    if model_index is None:
+        model_index = build_model_index(old_model_stmts)
     # If new cord statements are not provided, load from database
     if not new_cord_stmts:
         # Get text refs from metadata
-        tr_dicts, _ = get_tr_dicts_and_ids()
+        tr_dicts, _ = get_tr_dicts_and_ids(use_cache=use_cache)
         # Filter to text refs that are not part of old model
+        old_tr_ids = model_index['known_trids']
+        changed_uids = release_diff.changed if release_diff else set()
         new_tr_dicts = {}
-        old_tr_ids = set()
-        for stmt in old_model_stmts: 
-            for evid in stmt.evidence: 
-                if evid.text_refs.get('TRID'): 
-                    old_tr_ids.add(evid.text_refs['TRID'])
         for tr_id in tr_dicts: 
-            if tr_id not in old_tr_ids: 
+            if tr_id not in old_tr_ids or \
+                    tr_dicts[tr_id].get('CORD19_UID') in changed_uids:
                 new_tr_dicts[tr_id] = tr_dicts[tr_id]
         logger.info('Found %d TextRefs, %d of which are not in old model'
                     % (len(tr_dicts), len(new_tr_dicts)))
         # Get statements for new text re
-        new_cord_stmts = get_raw_stmts(new_tr_dicts, date_limit=date_limit)
+        new_cord_stmts = get_raw_stmts(new_tr_dicts, date_limit=date_limit,
+                                       chunk_size=10000 if n_threads else None,
+                                       n_threads=n_threads)
 
     logger.info('Processing the statements')
-    # Filter out ungrounded statements
-    new_cord_grounded = ac.filter_grounded_only(new_cord_stmts)
-
-    # Group statements by TextRef
-    old_model_by_tr, _ = stmts_by_text_refs(old_model_stmts)
-    new_cord_by_tr, _ = stmts_by_text_refs(new_cord_grounded)
-
-    # Add any EMMAA statements from non-Cord19 publications
-    updated_model_stmts_by_tr = combine_stmts(new_cord_by_tr, old_model_by_tr)
+    # Filter out ungrounded statements and group the new statements by
+    # TextRef, statements of the old model are kept unless their TextRef has
+    # new statements
+    new_cord_by_tr, _ = group_grounded_stmts(new_cord_stmts, n_proc=n_proc)
     updated_model_stmts = [
-        s for stmt_list in updated_model_stmts_by_tr.values()
-        for s in stmt_list]
+        s for stmt_list in new_cord_by_tr.values() for s in stmt_list]
+    for stmt in old_model_stmts:
+        trid = stmt.evidence[0].text_refs.get('TRID')
+        if trid is not None and trid not in new_cord_by_tr:
+            updated_model_stmts.append(stmt)
+
+    # Update the index with the delta
+    update_model_index(model_index, new_cord_by_tr)
 
     logger.info('Got %d total statements.' % len(updated_model_stmts))
-    logger.info('Processed %d papers.' % len(updated_model_stmts_by_tr))
-    return updated_model_stmts, updated_model_stmts_by_tr.keys()
+    logger.info('Processed %d papers.' % len(model_index['hashes_by_trid']))
+    return updated_model_stmts, model_index['hashes_by_trid'].keys()
 
 if __name__ == '__main__':
     # Example:
     # python covid_19/emmaa_update.py \
     #            -om stmts/model_2020-05-17-17-10-07.pkl \
-    #            -nc stmts/cord19_all_db_raw_stmts.pkl \
+    #            -nc stmts/cord19_all_db_raw_stmts.stmts \
     #            -d stmts/drug_stmts.pkl \
     #            -g stmts/gordon_ndex_stmts.pkl \
     #            -v stmts/virhostnet_stmts.pkl \
@@ -128,27 +273,93 @@ if __name__ == '__main__':
     parser.add_argument('-f', '--output_file',
                          help='Output file for combined pkl',
                          required=True)
+    parser.add_argument('-r', '--release_date',
+                        help='CORD19 release date to use, e.g. 2020-06-15 '
+                             '(optional, default: latest release)',
+                        required=False)
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='Also update statements for CORD19 documents '
+                             'that changed since the previous release '
+                             'available locally')
+    parser.add_argument('-mi', '--model_index',
+                        help='Path to the TextRef index of the old model '
+                             '(optional, default: next to the old model '
+                             'pkl). It is built and saved there if it is '
+                             'missing or was saved for another version of '
+                             'the old model. The updated index is saved '
+                             'next to the output file, where it is found '
+                             'when the output is the old model of the next '
+                             'update.',
+                        required=False)
+    parser.add_argument('-s', '--stream', action='store_true',
+                        help='Read the statement files one at a time, '
+                             'deduplicate statements and write the output '
+                             'incrementally as a statement store (see '
+                             'covid_19.stmt_store) instead of a pkl. '
+                             'Pickle loaders like EMMAA\'s can\'t read it, '
+                             'so the output file has to have a .stmts '
+                             'extension rather than .pkl.')
+    parser.add_argument('-t', '--n_threads', type=int,
+                        help='Number of concurrent DB queries to pull new '
+                             'CORD-19 statements with (optional)',
+                        required=False)
+    parser.add_argument('-n', '--n_proc', type=int,
+                        help='Number of processes to filter and group new '
+                             'CORD-19 statements with (optional)',
+                        required=False)
+    parser.add_argument('--snapshot', action='store_true',
+                        help='Write a snapshot of the old model next to it '
+                             'if there is none, so that later runs on the '
+                             'same model load it faster')
+    parser.add_argument('--no_cache', action='store_true',
+                        help='Look up all CORD-19 TextRefs in the DB instead '
+                             'of using the on-disk TextRef cache')
     args = parser.parse_args()
+    if args.stream and args.output_file.endswith('.pkl'):
+        parser.error('--stream writes a statement store, not a pkl, use an '
+                     'output file with a .stmts extension')
+    set_release_date(args.release_date)
 
     # Load everything
     logger.info('Loading statements from pickle files')
-    with open(args.old_model, 'rb') as f:
-        old_model_emmaa_stmts = pickle.load(f)
-        old_model_stmts = [es.stmt for es in old_model_emmaa_stmts]
+    old_model_stmts = load_model_stmts(args.old_model,
+                                       write_snapshot=args.snapshot)
     if args.new_cord:
-        new_cord_stmts = ac.load_statements(args.new_cord)
+        new_cord_stmts = stmt_store.load_statements(args.new_cord)
     else:
         new_cord_stmts = None
-    drug_stmts = ac.load_statements(args.drug_stmts)
-    gordon_stmts = ac.load_statements(args.gordon_stmts)
-    virhostnet_stmts = ac.load_statements(args.virhostnet_stmts)
-    ctd_stmts = ac.load_statements(args.ctd_stmts)
-
-    other_stmts = drug_stmts + gordon_stmts + virhostnet_stmts + ctd_stmts
 
+    release_diff = diff_releases() if args.incremental else None
+    # The index of the old model is kept next to it. It is only used if it
+    # was saved for the old model file as it is now, otherwise it is built
+    # from the loaded statements in a single pass.
+    model_index_file = args.model_index or \
+        get_model_index_file(args.old_model)
+    model_index = load_model_index(model_index_file, args.old_model)
+    if model_index is None:
+        model_index = build_model_index(old_model_stmts)
+        save_model_index(model_index, model_index_file, args.old_model)
     model_stmts, _ = make_model_stmts(
-        old_model_stmts, new_cord_stmts)
+        old_model_stmts, new_cord_stmts, release_diff=release_diff,
+        n_threads=args.n_threads, model_index=model_index,
+        n_proc=args.n_proc, use_cache=not args.no_cache)
+    del old_model_stmts, new_cord_stmts
 
-    combined_stmts = model_stmts + other_stmts
-    # Dump new pickle
-    ac.dump_statements(combined_stmts, args.output_file)
+    other_files = [args.drug_stmts, args.gordon_stmts,
+                   args.virhostnet_stmts, args.ctd_stmts]
+    if args.stream:
+        # Read the other inputs one at a time and write a statement store
+        stmt_iters = [model_stmts] + [iter_stmts_from_file(fname)
+                                      for fname in other_files]
+        del model_stmts
+        stream_merge_stmts(stmt_iters, args.output_file)
+    else:
+        other_stmts = []
+        for fname in other_files:
+            other_stmts += stmt_store.load_statements(fname)
+        combined_stmts = model_stmts + other_stmts
+        # Dump new pickle
+        ac.dump_statements(combined_stmts, args.output_file)
+    # Save the updated index for the next update from the output
+    save_model_index(model_index, get_model_index_file(args.output_file),
+                     args.output_file)
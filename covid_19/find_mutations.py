@@ -1,7 +1,8 @@
 import re
 import csv
-from covid_19.preprocess import get_metadata_dict, get_zip_texts_for_entry, \
-                                get_metadata_df, get_all_texts
+from covid_19.preprocess import get_zip_texts_for_entry, \
+    get_texts_for_entries
+from covid_19.metadata import get_metadata_table
 from indra_db.util import get_db
 
 
@@ -14,7 +15,7 @@ with open(covid_docs_file, 'rt') as f:
         covid_pmids.add(pmid)
 
 
-md = get_metadata_dict()
+md = get_metadata_table()
 
 
 aa_reg = '[ACDEFGHIKLMNPQRSTVWY]'
@@ -39,14 +40,15 @@ ignore_list = (
 )
 
 
-texts_by_file = get_all_texts()
+# Only extract the texts of the documents we are going to look at, this is
+# much faster than building the full text index for a one-off scan
+md = [md_entry for md_entry in md if md_entry['pubmed_id'] in covid_pmids]
+texts_by_file = get_texts_for_entries(md)
 by_mut = {}
 by_doc = {}
 for ix, md_entry in enumerate(md):
     pmid = md_entry['pubmed_id']
     title = md_entry['title']
-    if pmid not in covid_pmids:
-        continue
     texts = get_zip_texts_for_entry(md_entry, texts_by_file, zip=False)
     cord_uid = md_entry['cord_uid']
     for _, text_type, text in texts:
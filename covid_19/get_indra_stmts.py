@@ -7,33 +7,61 @@ import zlib
 import logging
 import argparse
 import datetime
-from copy import deepcopy
+import pandas as pd
+import threading
 from itertools import groupby
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from os.path import abspath, dirname, join
+from sqlalchemy import case, func
 from indra.util import batch_iter
 from indra_db.util import get_db
 from indra_db.util import distill_stmts
 from indra.statements import stmts_from_json, stmts_to_json
 from indra.tools import assemble_corpus as ac
 from indra.literature import pubmed_client
-from covid_19.preprocess import get_ids, fix_doi, fix_pmid, get_metadata_dict, \
-                                get_text_refs_from_metadata, download_metadata
+from covid_19.preprocess import get_ids, fix_doi, fix_pmid, \
+                                get_text_refs_df, \
+                                get_text_refs_for_entries, download_metadata, \
+                                set_release_date, text_ref_mappings
+from covid_19 import stmt_store
+from covid_19.metadata import get_metadata_table
+from covid_19.resolve_text_refs import iter_text_refs_for_ids
+from covid_19.text_ref_cache import get_cached_tr_dicts_and_ids
 
 logger = logging.getLogger(__name__)
 
 
-def get_unique_text_refs():
+def get_unique_text_refs(bulk=False):
     """Get unique INDRA DB TextRef IDs for all identifiers in CORD19.
 
     Queries TextRef IDs with PMIDs, PMCIDs, and DOIs from CORD19, then
     deduplicates to obtain a unique set of TextRefs.
 
+    Parameters
+    ----------
+    bulk : Optional[bool]
+        If True, resolve all identifiers with a single temporary table join
+        (see covid_19.resolve_text_refs) instead of separate batched queries
+        per identifier type. Default: False
+
     Returns
     -------
-    set of ints
-        Unique TextRef IDs.
+    list of dict
+        Unique TextRef dictionaries.
     """
+    if bulk:
+        md = get_metadata_table(columns=['pubmed_id', 'pmcid', 'doi'])
+        id_triples = {(tr.get('PMID'), tr.get('PMCID'), tr.get('DOI'))
+                      for tr in get_text_refs_for_entries(md)}
+        db = get_db('primary')
+        conn = db.engine.raw_connection()
+        try:
+            text_refs = list(iter_text_refs_for_ids(conn, id_triples))
+        finally:
+            conn.close()
+        print(len(text_refs), "unique TextRefs in DB")
+        return text_refs
     pmcids = get_ids('pmcid')
     pmids = [fix_pmid(pmid) for pmid in get_ids('pubmed_id')]
     dois = [fix_doi(doi) for doi in get_ids('doi')]
@@ -101,17 +129,276 @@ def get_indradb_pa_stmts():
     return stmt_jsons
 
 
+# Priorities of text types and content sources when choosing the reading of
+# a TextRef to use, lower values are preferred
+text_type_priorities = {'fulltext': 0, 'abstract': 1, 'title': 2}
+source_priorities = {'pmc_oa': 0, 'manuscripts': 1, 'elsevier': 2,
+                     'cord19_pmc_xml': 3, 'cord19_pdf': 4,
+                     'cord19_abstract': 5, 'pubmed': 6}
+
+
+def iter_best_reach_readings(trids, reach_version='1.6.1',
+                             prioritize_by='type', yield_per=1000):
+    """Iterate over the best REACH reading of each TextRef.
+
+    The readings are prioritized in the DB with DISTINCT ON and ORDER BY,
+    so only the best reading of each TextRef is transferred, and the
+    results are consumed through a server-side cursor so that memory use
+    doesn't grow with the number of readings.
+
+    Parameters
+    ----------
+    trids : iterable of int
+        The IDs of the TextRefs to get readings for.
+    reach_version : Optional[str]
+        The REACH version of the readings. Default: 1.6.1
+    prioritize_by : Optional[str]
+        'type' to prefer readings by text type and then by content source,
+        or 'length' to prefer the longest reading. Default: 'type'
+    yield_per : Optional[int]
+        The number of rows fetched from the DB at a time. Default: 1000
+
+    Yields
+    ------
+    tuple
+        (Reading, TextRef, source, text_type) results ordered by TextRef ID,
+        the same as those chosen by get_reach_readings.
+    """
+    db = get_db('primary')
+    if prioritize_by == 'type':
+        order = [case(text_type_priorities, value=db.TextContent.text_type,
+                      else_=100),
+                 case(source_priorities, value=db.TextContent.source,
+                      else_=100)]
+    else:
+        order = [func.length(db.Reading.bytes).desc()]
+    db.grab_session()
+    query = db.session.query(db.Reading, db.TextRef, db.TextContent.source,
+                             db.TextContent.text_type) \
+        .filter(db.TextRef.id.in_(list(trids)),
+                db.TextContent.text_ref_id == db.TextRef.id,
+                db.Reading.text_content_id == db.TextContent.id,
+                db.Reading.reader.like('REACH'),
+                db.Reading.reader_version.like(reach_version)) \
+        .distinct(db.TextRef.id) \
+        .order_by(db.TextRef.id, *order) \
+        .execution_options(stream_results=True) \
+        .yield_per(yield_per)
+    unhandled = set()
+    for rd in query:
+        if prioritize_by == 'type':
+            # Report types and sources the priorities don't cover, once each
+            for val, priorities in ((rd[3], text_type_priorities),
+                                    (rd[2], source_priorities)):
+                if val not in priorities and val not in unhandled:
+                    logger.info('Unhandled text type or source: %s' % val)
+                    unhandled.add(val)
+        yield rd
+
+
+def _iter_dumped_readings(rds_filt, tr_dicts, dump_dir, index_type, n_proc,
+                          shard, raw_gzip, chunk_size):
+    # Record the chosen readings in tr_dicts and dump their outputs,
+    # yielding each reading result once it was handed to the dump
+    trs_by_cord = {}
+    # If a dump directory is given, put all files in it
+    if dump_dir:
+        logger.info('Dumping Reach outputs')
+        json_dir = join(dump_dir, 'json')
+        if not os.path.exists(json_dir):
+            os.mkdir(json_dir)
+        if shard:
+            for shard_ix in range(256):
+                os.makedirs(join(json_dir, '%02x' % shard_ix), exist_ok=True)
+    # Files are written by a pool of workers in chunks, with a bounded
+    # number of chunks in flight
+    executor = ProcessPoolExecutor(n_proc) if n_proc and n_proc > 1 \
+        else None
+    pending = deque()
+    chunk = []
+    dumped = [0, 0]
+    ts = time.time()
+
+    def record(result):
+        dumped[0] += result[0]
+        dumped[1] += result[1]
+
+    def dump_chunk(chunk):
+        if executor is None:
+            record(_dump_readings(chunk, raw_gzip))
+            return
+        pending.append(executor.submit(_dump_readings, chunk, raw_gzip))
+        while len(pending) >= 2 * n_proc:
+            record(pending.popleft().result())
+
+    try:
+        for reading_result in tqdm.tqdm(rds_filt):
+            reading = reading_result.Reading
+            tr = reading_result.TextRef
+            tr_dicts[tr.id]['READING_ID'] = reading.id
+            # If the reading output is empty, skip
+            if dump_dir and reading.bytes:
+                text_ref = tr_dicts[tr.id]
+                if index_type == 'cord19':
+                    cord_uid = text_ref['CORD19_UID']
+                    trs_by_cord[cord_uid] = text_ref
+                    name = cord_uid
+                else:
+                    name = str(tr.id)
+                chunk.append((get_dump_path(json_dir, name, shard,
+                                            raw_gzip), reading.bytes))
+                if len(chunk) >= chunk_size:
+                    dump_chunk(chunk)
+                    chunk = []
+            yield reading_result
+        if chunk:
+            dump_chunk(chunk)
+        while pending:
+            record(pending.popleft().result())
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    if dump_dir:
+        elapsed = time.time() - ts
+        logger.info('Dumped %d Reach outputs (%.1f MB) in %.1fs'
+                    % (dumped[0], dumped[1] / 1e6, elapsed))
+    if dump_dir and index_type == 'cord19':
+        # Dump the metadata dictionary
+        with open(join(dump_dir, 'metadata.json'), 'wt') as f:
+            json.dump(trs_by_cord, f, indent=2)
+
+
 def get_reach_readings(tr_dicts, dump_dir=None, reach_version='1.6.1',
-                       index_type='cord19', prioritize_by='type'):
+                       index_type='cord19', prioritize_by='type',
+                       n_proc=None, shard=False, raw_gzip=False,
+                       chunk_size=100):
+    """Get the best REACH reading for each TextRef and optionally dump them.
+
+    All readings of the TextRefs are loaded and sorted to choose the best
+    one of each TextRef. Use iter_reach_readings to choose the readings in
+    the DB and stream them instead.
+
+    Parameters
+    ----------
+    tr_dicts : dict
+        TextRef dictionaries keyed by TRID, updated with the READING_ID of
+        the chosen reading.
+    dump_dir : Optional[str]
+        A directory to dump the reading outputs into as JSON files.
+    reach_version : Optional[str]
+        The REACH version of the readings. Default: 1.6.1
+    index_type : Optional[str]
+        'cord19' to name files by CORD19 UID and dump the TextRef metadata,
+        otherwise files are named by TRID. Default: 'cord19'
+    prioritize_by : Optional[str]
+        'type' to prefer readings by text type and then by content source,
+        or 'length' to prefer the longest reading. Default: 'type'
+    n_proc : Optional[int]
+        If larger than 1, the outputs are decompressed and written by a pool
+        of this many worker processes. Default: None (serial dump)
+    shard : Optional[bool]
+        If True, spread the dumped files over 256 subdirectories of the json
+        directory, see get_dump_path. Default: False
+    raw_gzip : Optional[bool]
+        If True, write the gzipped outputs as stored in the DB to .json.gz
+        files instead of decompressing them. Default: False
+    chunk_size : Optional[int]
+        The number of outputs sent to a worker process at a time.
+        Default: 100
+
+    Returns
+    -------
+    list
+        The (Reading, TextRef, source, text_type) results of the best
+        readings.
+    """
+    rds_filt = _get_best_reach_readings(tr_dicts.keys(), reach_version,
+                                        prioritize_by)
+    for _ in _iter_dumped_readings(rds_filt, tr_dicts, dump_dir, index_type,
+                                   n_proc, shard, raw_gzip, chunk_size):
+        pass
+    return rds_filt
+
+
+def iter_reach_readings(tr_dicts, dump_dir=None, reach_version='1.6.1',
+                        index_type='cord19', prioritize_by='type',
+                        n_proc=None, shard=False, raw_gzip=False,
+                        chunk_size=100):
+    """Iterate over the best REACH reading of each TextRef, dumping them.
+
+    This is the streaming counterpart of get_reach_readings with the same
+    parameters. The best readings are chosen in the DB with
+    iter_best_reach_readings, so memory use doesn't grow with the number
+    of readings. Outputs are dumped as the readings are consumed, and the
+    metadata once they all were, so the iterator has to be exhausted.
+
+    Yields
+    ------
+    tuple
+        The (Reading, TextRef, source, text_type) results of the best
+        readings, as in the list returned by get_reach_readings.
+    """
+    logger.info('Streaming prioritized Reach outputs')
+    rds_filt = iter_best_reach_readings(tr_dicts.keys(), reach_version,
+                                        prioritize_by)
+    yield from _iter_dumped_readings(rds_filt, tr_dicts, dump_dir,
+                                     index_type, n_proc, shard, raw_gzip,
+                                     chunk_size)
+
+
+def get_dump_path(json_dir, name, shard=False, raw_gzip=False):
+    """Return the path that a Reach output is dumped to.
+
+    Parameters
+    ----------
+    json_dir : str
+        The directory Reach outputs are dumped into.
+    name : str
+        The name of the output, a CORD19 UID or a TRID.
+    shard : Optional[bool]
+        If True, the file is put in one of 256 subdirectories named by the
+        last byte of the CRC32 of the name in hex. Default: False
+    raw_gzip : Optional[bool]
+        If True, the file is the gzipped output as stored in the DB, with a
+        .json.gz extension. Default: False
+
+    Returns
+    -------
+    str
+        The path of the file.
+    """
+    fname = name + ('.json.gz' if raw_gzip else '.json')
+    if shard:
+        shard_dir = '%02x' % (zlib.crc32(name.encode('utf8')) & 0xff)
+        return join(json_dir, shard_dir, fname)
+    return join(json_dir, fname)
+
+
+def _dump_readings(items, raw_gzip=False):
+    # Write a chunk of (path, bytes) Reach outputs, returning the number of
+    # files and bytes written
+    n_bytes = 0
+    for path, content in items:
+        if raw_gzip:
+            with open(path, 'wb') as f:
+                f.write(content)
+        else:
+            content = zlib.decompress(content, 16+zlib.MAX_WBITS)
+            with open(path, 'wt') as f:
+                f.write(content.decode('utf8'))
+        n_bytes += len(content)
+    return len(items), n_bytes
+
+
+def _get_best_reach_readings(trids, reach_version, prioritize_by):
     db = get_db('primary')
-    # Get text ref dicts with article metadata aligned between DB and CORD19
     # Get REACH readings
     ts = time.time()
     logger.info('Querying for Reach outputs')
     reach_data = db.select_all((db.Reading, db.TextRef,
                                 db.TextContent.source,
                                 db.TextContent.text_type),
-                               db.TextRef.id.in_(tr_dicts.keys()),
+                               db.TextRef.id.in_(trids),
                                db.TextContent.text_ref_id == db.TextRef.id,
                                db.Reading.text_content_id == db.TextContent.id,
                                db.Reading.reader.like('REACH'),
@@ -125,10 +412,6 @@ def get_reach_readings(tr_dicts, dump_dir=None, reach_version='1.6.1',
 
     if prioritize_by == 'type':
         def content_priority_func(rd):
-            text_type_priorities = {'fulltext': 0, 'abstract': 1, 'title': 2}
-            source_priorities = {'pmc_oa': 0, 'manuscripts': 1, 'elsevier': 2,
-                                 'cord19_pmc_xml': 3, 'cord19_pdf': 4,
-                                 'cord19_abstract': 5, 'pubmed': 6}
             if rd[3] not in text_type_priorities:
                 logger.info('Unhandled text type: %s' % rd[3])
             if rd[2] not in source_priorities:
@@ -150,192 +433,384 @@ def get_reach_readings(tr_dicts, dump_dir=None, reach_version='1.6.1',
     for tr_id, tr_group in groupby(reach_data, tr_id_key_func):
         rds = list(tr_group)
         best_reading = rds[0]
-        tr_dicts[tr_id]['READING_ID'] = best_reading.Reading.id
         rds_filt.append(best_reading)
-    # If a dump directory is given, put all files in it
-    trs_by_cord = {}
-    logger.info('Dumping Reach outputs')
-    if dump_dir:
-        json_dir = join(dump_dir, 'json')
-        if not os.path.exists(json_dir):
-            os.mkdir(json_dir)
-        for reading_result in tqdm.tqdm(rds_filt):
-            reading = reading_result.Reading
-            # If the reading output is empty, skip
-            if not reading.bytes:
-                continue
-            tr = reading_result.TextRef
-            text_ref = tr_dicts[tr.id]
-            if index_type == 'cord19':
-                cord_uid = text_ref['CORD19_UID']
-                trs_by_cord[cord_uid] = text_ref
-                fname = f'{cord_uid}.json'
-            else:
-                fname = f'{str(tr.id)}.json'
-            with open(join(json_dir, fname), 'wt') as f:
-                content = zlib.decompress(reading.bytes, 16+zlib.MAX_WBITS)
-                f.write(content.decode('utf8'))
-        if index_type == 'cord19':
-            # Dump the metadata dictionary
-            with open(join(dump_dir, 'metadata.json'), 'wt') as f:
-                json.dump(trs_by_cord, f, indent=2)
     return rds_filt
 
 
-def get_raw_stmts(tr_dicts, date_limit=None):
-    """Return all raw stmts in INDRA DB for a given set of TextRef IDs.
+def _get_chunk_stmts(db, trids, start_date=None):
+    # Distill the statements of a chunk of TextRefs, returning them in an
+    # order that doesn't depend on the DB along with the query time
+    ts = time.time()
+    clauses = [
+        db.TextRef.id.in_(trids),
+        db.TextContent.text_ref_id == db.TextRef.id,
+        db.Reading.text_content_id == db.TextContent.id,
+        db.RawStatements.reading_id == db.Reading.id]
+    if start_date:
+        clauses.append(db.Reading.create_date > start_date)
+    db_stmts = distill_stmts(db, get_full_stmts=True, clauses=clauses)
+    stmts = sorted(db_stmts, key=lambda stmt:
+                   (stmt.evidence[0].text_refs['TRID'], stmt.uuid))
+    return stmts, time.time() - ts
+
+
+def _close_db(db):
+    # Close the session of a DB manager and the connections of its engine
+    if getattr(db, 'session', None) is not None:
+        db.session.close()
+    db.engine.dispose()
+
+
+def _iter_concurrent_chunk_stmts(trid_chunks, start_date, n_threads):
+    # Run chunk queries in a thread pool with a bounded number of chunks in
+    # flight, and return results in the order of the chunks. DB sessions
+    # can't be shared between threads, so each worker thread gets its own
+    # DB manager, and all of them are closed when the pool shuts down.
+    thread_local = threading.local()
+    dbs = []
+    dbs_lock = threading.Lock()
+
+    def get_chunk_stmts(trids):
+        db = getattr(thread_local, 'db', None)
+        if db is None:
+            db = get_db('primary')
+            thread_local.db = db
+            with dbs_lock:
+                dbs.append(db)
+        return _get_chunk_stmts(db, trids, start_date)
+
+    max_pending = 2 * n_threads
+    try:
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            pending = deque()
+            for trid_chunk in trid_chunks:
+                pending.append(executor.submit(get_chunk_stmts,
+                                               list(trid_chunk)))
+                while len(pending) >= max_pending:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    finally:
+        for db in dbs:
+            _close_db(db)
+
+
+def iter_raw_stmts(tr_dicts, date_limit=None, chunk_size=10000,
+                   n_threads=None):
+    """Iterate over the raw stmts in INDRA DB for a given set of TextRef IDs.
+
+    Statements are distilled for chunks of TextRefs at a time, so only the
+    statements of a bounded number of chunks are in memory at once.
+    Statements are yielded chunk by chunk, ordered by TRID and UUID within
+    each chunk, so the order doesn't depend on n_threads.
 
     Parameters
     ----------
     tr_dicts : dict of text ref information
         Keys are text ref IDs (ints) mapped to dictionaries of text ref
         metadata.
-
     date_limit : Optional[int]
         A number of days to check the readings back.
-
-    Returns
-    -------
-    list of stmts
-        Raw INDRA Statements retrieved from the INDRA DB.
+    chunk_size : Optional[int]
+        The number of TextRefs to get statements for at a time. If None,
+        statements are distilled for all TextRefs at once. Default: 10000
+    n_threads : Optional[int]
+        If larger than 1, this many chunks are queried concurrently, each
+        thread with its own DB connection. Default: None (one chunk at a
+        time)
+
+    Yields
+    ------
+    indra.statements.Statement
+        Raw INDRA Statements with the text refs of their evidence updated
+        with the aligned DB/CORD19 dictionaries.
     """
-    # Get raw statement IDs from the DB for the given TextRefs
-    db = get_db('primary')
-    # Get statements for the given text refs
     text_ref_ids = list(tr_dicts.keys())
     print(f"Distilling statements for {len(text_ref_ids)} TextRefs")
-    start = time.time()
-    clauses = [
-        db.TextRef.id.in_(text_ref_ids),
-        db.TextContent.text_ref_id == db.TextRef.id,
-        db.Reading.text_content_id == db.TextContent.id,
-        db.RawStatements.reading_id == db.Reading.id]
+    start_date = None
     if date_limit:
         start_date = (
             datetime.datetime.utcnow() - datetime.timedelta(days=date_limit))
         print(f'Limiting to stmts from readings in the last {date_limit} days')
-        clauses.append(db.Reading.create_date > start_date)
-    db_stmts = distill_stmts(db, get_full_stmts=True, clauses=clauses)
-    # Group lists of statements by the IDs TextRef that they come from
-    stmts_by_trid = {}
-    for stmt in db_stmts:
-        trid = stmt.evidence[0].text_refs['TRID']
-        if trid not in stmts_by_trid:
-            stmts_by_trid[trid] = [stmt]
-        else:
-            stmts_by_trid[trid].append(stmt)
-    # For every statement, update the text ref dictionary of the evidence
-    # object with the aligned DB/CORD19 dictionaries obtained from the
-    # function cord19_metadata_for_trs:
-    stmts_flat = []
-    for tr_id, stmt_list in stmts_by_trid.items():
-        tr_dict = tr_dicts[tr_id]
-        if tr_dict:
-            for stmt in stmt_list:
+    start = time.time()
+    trid_chunks = batch_iter(text_ref_ids, chunk_size) if chunk_size \
+        else [text_ref_ids]
+    if n_threads and n_threads > 1:
+        results = _iter_concurrent_chunk_stmts(trid_chunks, start_date,
+                                               n_threads)
+    else:
+        db = get_db('primary')
+        results = (_get_chunk_stmts(db, list(trid_chunk), start_date)
+                   for trid_chunk in trid_chunks)
+    for ix, (stmts, query_time) in enumerate(results):
+        # For every statement, update the text ref dictionary of the
+        # evidence object with the aligned DB/CORD19 dictionaries obtained
+        # from the function cord19_metadata_for_trs
+        for stmt in stmts:
+            tr_dict = tr_dicts[stmt.evidence[0].text_refs['TRID']]
+            if tr_dict:
                 stmt.evidence[0].text_refs.update(tr_dict)
-        stmts_flat += stmt_list
+            yield stmt
+        logger.info('TextRef chunk %d: %d statements, query took %.1fs, '
+                    '%.1fs elapsed' % (ix, len(stmts), query_time,
+                                       time.time() - start))
     elapsed = time.time() - start
     print(f"{elapsed} seconds")
-    return stmts_flat
 
 
-def dump_raw_stmts(tr_dicts, stmt_file):
-    """Dump all raw stmts in INDRA DB for a given set of TextRef IDs.
+def get_raw_stmts(tr_dicts, date_limit=None, chunk_size=None, n_threads=None):
+    """Return all raw stmts in INDRA DB for a given set of TextRef IDs.
 
     Parameters
     ----------
     tr_dicts : dict of text ref information
         Keys are text ref IDs (ints) mapped to dictionaries of text ref
         metadata.
-    stmt_file : str
-        Path to file to dump pickled raw statements.
+
+    date_limit : Optional[int]
+        A number of days to check the readings back.
+    chunk_size : Optional[int]
+        The number of TextRefs to get statements for at a time, see
+        iter_raw_stmts. Default: None (all at once)
+    n_threads : Optional[int]
+        The number of chunks to query concurrently, see iter_raw_stmts.
+        Default: None
 
     Returns
     -------
     list of stmts
         Raw INDRA Statements retrieved from the INDRA DB.
     """
-    # Get the INDRA Statement JSON for the Statement IDs
-    stmts_flat = get_raw_stmts(tr_dicts)
-    ac.dump_statements(stmts_flat, stmt_file)
-    return stmts_flat
-
-
-def cord19_metadata_for_trs(text_ref_dicts, md):
-    """Get unified text_ref info given TextRef dictionaries and CORD19 metadata."""
-    # Build up a sect of dictionaries for reverse lookup of TextRefs by
-    # different IDs (DOI, PMC, PMID, etc.)
-    tr_ids_by_doi = defaultdict(set)
-    tr_ids_by_pmc = defaultdict(set)
-    tr_ids_by_pmid = defaultdict(set)
+    return list(iter_raw_stmts(tr_dicts, date_limit=date_limit,
+                               chunk_size=chunk_size, n_threads=n_threads))
+
+
+def dump_raw_stmts(tr_dicts, stmt_file, date_limit=None, chunk_size=10000,
+                   n_threads=None):
+    """Dump all raw stmts in INDRA DB for a given set of TextRef IDs.
+
+    Statements are written to a statement store (see covid_19.stmt_store)
+    chunk by chunk as they are retrieved, so memory use is bounded by the
+    chunk size rather than the number of statements. Unlike earlier
+    versions, no pickle is written; use stmt_store.load_statements to load
+    the statements, which also reads pickles.
+
+    Parameters
+    ----------
+    tr_dicts : dict of text ref information
+        Keys are text ref IDs (ints) mapped to dictionaries of text ref
+        metadata.
+    stmt_file : str
+        Path to the statement store to dump raw statements into.
+    date_limit : Optional[int]
+        A number of days to check the readings back.
+    chunk_size : Optional[int]
+        The number of TextRefs to get statements for at a time.
+        Default: 10000
+    n_threads : Optional[int]
+        The number of chunks to query concurrently, see iter_raw_stmts.
+        Default: None
+
+    Returns
+    -------
+    int
+        The number of statements dumped.
+    """
+    with stmt_store.StatementStoreWriter(stmt_file) as writer:
+        for stmt in iter_raw_stmts(tr_dicts, date_limit=date_limit,
+                                   chunk_size=chunk_size,
+                                   n_threads=n_threads):
+            writer.write(stmt)
+    logger.info('Dumped %d statements into %s' % (writer.count, stmt_file))
+    return writer.count
+
+
+class ConflictReport(object):
+    """Counts and a bounded number of examples of conflicts by kind.
+
+    Parameters
+    ----------
+    max_examples : Optional[int]
+        The maximum number of examples kept for each kind of conflict.
+        Default: 100
+    """
+    def __init__(self, max_examples=100):
+        self.max_examples = max_examples
+        self.counts = defaultdict(int)
+        self.examples = defaultdict(list)
+
+    def add(self, kind, example):
+        self.counts[kind] += 1
+        if len(self.examples[kind]) < self.max_examples:
+            self.examples[kind].append(example)
+
+    def to_json(self):
+        return {'counts': dict(self.counts),
+                'examples': dict(self.examples)}
+
+    def __str__(self):
+        if not self.counts:
+            return 'No conflicts'
+        return ', '.join('%d %s' % (count, kind)
+                         for kind, count in sorted(self.counts.items()))
+
+
+def cord19_metadata_for_trs(text_ref_dicts, md, report=None):
+    """Get unified text_ref info given TextRef dictionaries and CORD19 metadata.
+
+    The TextRef dictionaries passed in are not modified; the returned
+    dictionaries are copies updated with the identifiers from CORD19.
+
+    If a CORD19 entry matches several TextRefs, each of them gets the CORD19
+    identifiers it doesn't have itself. Before, the identifiers were removed
+    from the entry as each TextRef was updated, so TextRefs updated later
+    (in set order) could miss identifiers that an earlier one already had.
+
+    Parameters
+    ----------
+    text_ref_dicts : list of dict
+        TextRef dictionaries from the DB.
+    md : MetadataTable or pandas.DataFrame or list of dict
+        CORD19 metadata.
+    report : Optional[ConflictReport]
+        A report to record conflicts in: 'mismatch' for identifiers that
+        differ between the DB and CORD19, 'multiple_trids' for CORD19
+        entries matching more than one TextRef, and 'multiple_entries' for
+        TextRefs matched by CORD19 entries with different CORD19 UIDs (of
+        which the last one is used). Default: a new report that is logged.
+
+    Returns
+    -------
+    tr_dicts : dict
+        TextRef dictionaries updated with CORD19 identifiers, keyed by TRID.
+    multiple_tr_ids : list of set
+        Sets of TRIDs matched by a single CORD19 entry.
+    """
+    if report is None:
+        report = ConflictReport()
+    # Build up a set of dictionaries for reverse lookup of TextRefs by
+    # different normalized IDs (DOI, PMC, PMID)
+    tr_ids_by_id = {'DOI': defaultdict(set), 'PMCID': defaultdict(set),
+                    'PMID': defaultdict(set)}
     trs_by_trid = {}
     for tr_dict in text_ref_dicts:
-        if tr_dict.get('DOI'):
-            tr_ids_by_doi[tr_dict['DOI']].add(tr_dict['TRID'])
-        if tr_dict.get('PMCID'):
-            tr_ids_by_pmc[tr_dict['PMCID']].add(tr_dict['TRID'])
-        if tr_dict.get('PMID'):
-            tr_ids_by_pmid[tr_dict['PMID']].add(tr_dict['TRID'])
+        for id_type, tr_ids in tr_ids_by_id.items():
+            if tr_dict.get(id_type):
+                tr_ids[tr_dict[id_type].upper()].add(tr_dict['TRID'])
         trs_by_trid[tr_dict['TRID']] = tr_dict
     multiple_tr_ids = []
-    mismatch_tr_ids = []
     tr_dicts = {}
+    # Normalize the identifiers of all CORD19 entries and look them up in
+    # the indexes column by column, so that only entries matching a TextRef
+    # are processed row by row
+    if isinstance(md, pd.DataFrame):
+        md_df = md
+    else:
+        md_df = pd.DataFrame({key: [entry.get(key) for entry in md]
+                              for key in text_ref_mappings})
+    refs = get_text_refs_df(md_df)
+    ref_cols = [(ref_key, refs[ref_key].tolist()) for ref_key in refs.columns]
+    id_types = list(tr_ids_by_id)
+    norm_ids = [[val.upper() if val is not None else None
+                 for val in refs[id_type]] for id_type in id_types]
+    tr_ids_by_col = [[tr_ids_by_id[id_type].get(norm_id) for norm_id in col]
+                     for id_type, col in zip(id_types, norm_ids)]
     # Iterate over all the entries in the CORD19 metadata
-    for md_row in md:
-        tr_md = get_text_refs_from_metadata(md_row)
-        # Find all the different TextRef IDs associated with the metadata
-        # for this CORD19 araticle
-        tr_ids_from_md = set()
-        if 'DOI' in tr_md and tr_ids_by_doi.get(tr_md['DOI'].upper()):
-            tr_ids_from_md |= tr_ids_by_doi[tr_md['DOI'].upper()]
-        if 'PMCID' in tr_md and tr_ids_by_pmc.get(tr_md['PMCID']):
-            tr_ids_from_md |= tr_ids_by_pmc[tr_md['PMCID']]
-        if 'PMID' in tr_md and tr_ids_by_pmid.get(tr_md['PMID']):
-            tr_ids_from_md |= tr_ids_by_pmid[tr_md['PMID']]
+    for ix, md_tr_ids in enumerate(zip(*tr_ids_by_col)):
         # No TextRef for this CORD19 entry, so skip it
-        if not tr_ids_from_md:
+        if not any(md_tr_ids):
             continue
+        # Find all the different TextRef IDs associated with the metadata
+        # for this CORD19 article
+        tr_ids_from_md = set()
+        for tr_ids in md_tr_ids:
+            if tr_ids:
+                tr_ids_from_md |= tr_ids
+        tr_md = {ref_key: col[ix] for ref_key, col in ref_cols
+                 if col[ix] is not None}
         # Multiple TextRef IDs for this CORD19 article
         if len(tr_ids_from_md) > 1:
-            print("More than one TextRef:", tr_md, tr_ids_from_md)
+            report.add('multiple_trids', {'cord19': tr_md,
+                                          'trids': sorted(tr_ids_from_md)})
             multiple_tr_ids.append(tr_ids_from_md)
-        # Now,  TRID and update text ref dict
         for trid in tr_ids_from_md:
-            tr_dict = trs_by_trid[trid]
-            # Prefer IDs from the database wherever there is overlap
-            for id_type in ('DOI', 'PMCID', 'PMID'):
-                if id_type in tr_dict and id_type in tr_md:
-                    if tr_md[id_type].upper() != tr_dict[id_type].upper():
-                        print("Mismatch between INDRA DB and CORD19:",
-                              tr_dict, tr_md)
-                        mismatch_tr_ids.append((tr_dict, deepcopy(tr_md)))
-                    tr_id_type = tr_md.pop(id_type)
-            # Now that we've eliminated any overlaps, we can just update
-            # the statement text ref dict
-            tr_dict.update(tr_md)
-            tr_dicts[tr_dict['TRID']] = tr_dict
+            tr_dict = tr_dicts.get(trid)
+            if tr_dict is None:
+                tr_dict = dict(trs_by_trid[trid])
+                tr_dicts[trid] = tr_dict
+            elif tr_dict.get('CORD19_UID') != tr_md.get('CORD19_UID'):
+                report.add('multiple_entries',
+                           {'trid': trid,
+                            'cord19_uids': [tr_dict.get('CORD19_UID'),
+                                            tr_md.get('CORD19_UID')]})
+            # Prefer IDs from the database wherever there is overlap. An ID
+            # that the TextRef was found by matches by construction.
+            for id_type, col, tr_ids in zip(id_types, norm_ids, md_tr_ids):
+                if id_type in tr_dict and col[ix] is not None and \
+                        (not tr_ids or trid not in tr_ids) and \
+                        col[ix] != tr_dict[id_type].upper():
+                    report.add('mismatch', {'db': dict(tr_dict),
+                                            'cord19': tr_md})
+            for key, val in tr_md.items():
+                if key not in tr_ids_by_id or key not in tr_dict:
+                    tr_dict[key] = val
+    logger.info('Aligned %d TextRefs with CORD19 metadata: %s'
+                % (len(tr_dicts), report))
     return tr_dicts, multiple_tr_ids
 
 
-def combine_all_stmts(pkl_list, output_file):
+def combine_all_stmts(pkl_list, output_file, json_output=False):
+    """Combine statements from several files and dump them.
+
+    The statements are dumped as a pickle into output_file and as a
+    statement store (see covid_19.stmt_store) with the .stmts extension
+    next to it. The indented JSON file that was written next to the pickle
+    before is now only written if json_output is True. Readers of the
+    JSON file can instead load the statement store with
+    stmt_store.load_statements, or stream it with stmt_store.StatementStore.
+
+    Parameters
+    ----------
+    pkl_list : list[str]
+        Paths to statement stores or pickles to combine.
+    output_file : str
+        The path of the pickle to dump the combined statements into.
+    json_output : Optional[bool]
+        If True, also dump the statements as indented JSON with the .json
+        extension next to the pickle. Default: False
+
+    Returns
+    -------
+    list[indra.statements.Statement]
+        The combined statements.
+    """
     all_stmts = []
     for pkl_file in pkl_list:
-        all_stmts.extend(ac.load_statements(pkl_file))
+        all_stmts.extend(stmt_store.load_statements(pkl_file))
     ac.dump_statements(all_stmts, output_file)
-    stmt_json = stmts_to_json(all_stmts)
-    output_json = f"{output_file.rsplit('.', maxsplit=1)[0]}.json"
-    with open(output_json, 'wt') as f:
-        json.dump(stmt_json, f, indent=2)
+    # Also write a statement store which, unlike the pickle, can be read
+    # without INDRA's class definitions matching and be streamed
+    output_store = f"{output_file.rsplit('.', maxsplit=1)[0]}.stmts"
+    stmt_store.dump_statements(all_stmts, output_store)
+    if json_output:
+        stmt_json = stmts_to_json(all_stmts)
+        output_json = f"{output_file.rsplit('.', maxsplit=1)[0]}.json"
+        with open(output_json, 'wt') as f:
+            json.dump(stmt_json, f, indent=2)
     return all_stmts
 
 
-def get_tr_dicts_and_ids():
+def get_tr_dicts_and_ids(bulk=False, use_cache=False):
     # Download metadata file if it is not in data directory
     download_metadata()
+    if use_cache:
+        # Only look up identifiers not seen in earlier releases
+        return get_cached_tr_dicts_and_ids()
     # Get the text ref objects from the DB corresponding to the CORD19
     # articles
-    text_refs = get_unique_text_refs()
-    md = get_metadata_dict()
+    text_refs = get_unique_text_refs(bulk=bulk)
+    # Only the identifier columns are needed to align metadata to TextRefs
+    md = get_metadata_table(columns=list(text_ref_mappings))
     tr_dicts, multiple_tr_ids = cord19_metadata_for_trs(text_refs, md)
     return tr_dicts, multiple_tr_ids
 
@@ -346,33 +821,72 @@ if __name__ == '__main__':
     parser.add_argument('-m', '--mode',
                         help='Mode (stmts, reach, or tr_dicts)',
                         required=True)
+    parser.add_argument('-r', '--release_date',
+                        help='CORD19 release date to use, e.g. 2020-06-15 '
+                             '(optional, default: latest release)',
+                        required=False)
+    parser.add_argument('-b', '--bulk', action='store_true',
+                        help='Resolve TextRefs with a single temporary '
+                             'table join')
+    parser.add_argument('-c', '--use_cache', action='store_true',
+                        help='Use the on-disk cache of TextRefs, only '
+                             'looking up new identifiers in the DB')
+    parser.add_argument('-s', '--stream', action='store_true',
+                        help='In reach mode, choose the best readings in '
+                             'the DB and stream them with a server-side '
+                             'cursor')
+    parser.add_argument('-n', '--n_proc', type=int,
+                        help='In reach mode, the number of processes to '
+                             'dump outputs with')
+    parser.add_argument('--shard', action='store_true',
+                        help='In reach mode, spread the dumped outputs over '
+                             'subdirectories')
+    parser.add_argument('--raw_gzip', action='store_true',
+                        help='In reach mode, dump the gzipped outputs as '
+                             'stored in the DB')
+    parser.add_argument('--json', action='store_true',
+                        help='In stmts mode, also dump the combined '
+                             'statements as indented JSON')
     args = parser.parse_args()
+    set_release_date(args.release_date)
 
     # Provide paths to all files
     stmts_dir = join(dirname(abspath(__file__)), '..', 'stmts')
-    db_stmts_file = join(stmts_dir, 'cord19_all_db_raw_stmts.pkl')
+    db_stmts_file = join(stmts_dir, 'cord19_all_db_raw_stmts.stmts')
     gordon_stmts_file = join(stmts_dir, 'gordon_ndex_stmts.pkl')
     eidos_stmts_file = join(stmts_dir, 'eidos_bio_statements_v2.pkl')
     combined_stmts_file = join(stmts_dir, 'cord19_combined_stmts.pkl')
     # Get the text ref objects from the DB corresponding to the CORD19
     # articles
-    tr_dicts, multiple_tr_ids = get_tr_dicts_and_ids()
+    tr_dicts, multiple_tr_ids = get_tr_dicts_and_ids(bulk=args.bulk,
+                                                     use_cache=args.use_cache)
 
     if args.mode == 'stmts':
-        db_stmts = dump_raw_stmts(tr_dicts, db_stmts_file)
+        dump_raw_stmts(tr_dicts, db_stmts_file)
         all_stmts = combine_all_stmts([db_stmts_file, gordon_stmts_file,
-                                       eidos_stmts_file], combined_stmts_file)
+                                       eidos_stmts_file], combined_stmts_file,
+                                       json_output=args.json)
     elif args.mode == 'reach':
-        reach_readings = get_reach_readings(tr_dicts,
-                                            dump_dir='cord19_reach_readings')
+        reach_kwargs = dict(dump_dir='cord19_reach_readings',
+                            n_proc=args.n_proc, shard=args.shard,
+                            raw_gzip=args.raw_gzip)
+        if args.stream:
+            n_readings = 0
+            for _ in iter_reach_readings(tr_dicts, **reach_kwargs):
+                n_readings += 1
+        else:
+            n_readings = len(get_reach_readings(tr_dicts, **reach_kwargs))
+        logger.info('Got the best Reach reading of %d TextRefs' % n_readings)
     elif args.mode == 'tr_dicts':
         # Dump tr_dicts as JSON file
         with open('tr_dicts.json', 'wt') as f:
             json.dump(tr_dicts, f, indent=2)
         multiple_trs = [('trid', 'pmid', 'pmcid', 'doi', 'manuscript_id')]
         for tr_set in multiple_tr_ids:
-            for tr in tr_set:
-                tr_data = (tr.id, tr.pmid, tr.pmcid, tr.doi, tr.manuscript_id)
+            for trid in sorted(tr_set):
+                tr = tr_dicts[trid]
+                tr_data = (trid, tr.get('PMID'), tr.get('PMCID'),
+                           tr.get('DOI'), tr.get('MANUSCRIPT_ID'))
                 multiple_trs.append(tr_data)
         with open('multiple_tr_ids.csv', 'wt') as f:
             csvwriter = csv.writer(f, delimiter=',')
@@ -0,0 +1,172 @@
+"""A compact in-memory table of the CORD19 metadata with identifier indexes.
+
+Rather than materializing a dictionary for each of the hundreds of thousands
+of metadata entries, the table stores one list per column and hands out
+lightweight row views that support the same lookups as the dictionaries
+returned by get_metadata_dict.
+"""
+import logging
+from covid_19.preprocess import get_metadata_df, get_release_date, fix_doi, \
+    fix_pmid, _nulls_to_none
+
+
+logger = logging.getLogger(__name__)
+
+
+class MetadataRow(object):
+    """A view of a single entry of a MetadataTable.
+
+    Parameters
+    ----------
+    table : MetadataTable
+        The table the row belongs to.
+    ix : int
+        The index of the row in the table.
+    """
+    __slots__ = ('table', 'ix')
+
+    def __init__(self, table, ix):
+        self.table = table
+        self.ix = ix
+
+    def __getitem__(self, key):
+        return self.table.columns[key][self.ix]
+
+    def __contains__(self, key):
+        return key in self.table.columns
+
+    def get(self, key, default=None):
+        column = self.table.columns.get(key)
+        if column is None:
+            return default
+        return column[self.ix]
+
+    def keys(self):
+        return self.table.columns.keys()
+
+    def to_dict(self):
+        """Return the row as a dictionary like those of get_metadata_dict."""
+        return {key: column[self.ix]
+                for key, column in self.table.columns.items()}
+
+    def __repr__(self):
+        return 'MetadataRow(%s)' % self.to_dict()
+
+
+class MetadataTable(object):
+    """Column-oriented CORD19 metadata with hash indexes on identifiers.
+
+    Indexes are built for cord_uid, DOI (normalized with fix_doi and
+    upper-cased), PMID and PMCID, each mapping an identifier to the list
+    of row indices with that identifier.
+
+    Parameters
+    ----------
+    md_df : pandas.DataFrame
+        The metadata data frame, as returned by get_metadata_df.
+    """
+    __slots__ = ('columns', 'size', 'by_cord_uid', 'by_doi', 'by_pmid',
+                 'by_pmcid')
+
+    def __init__(self, md_df):
+        md_df = _nulls_to_none(md_df)
+        self.columns = {col: md_df[col].tolist() for col in md_df.columns}
+        self.size = len(md_df)
+        self.by_cord_uid = self._build_index('cord_uid')
+        self.by_doi = self._build_index(
+            'doi', lambda doi: fix_doi(doi).upper())
+        self.by_pmid = self._build_index('pubmed_id', fix_pmid)
+        self.by_pmcid = self._build_index('pmcid')
+
+    def _build_index(self, col, norm_func=None):
+        index = {}
+        if col not in self.columns:
+            return index
+        for ix, val in enumerate(self.columns[col]):
+            if val is None:
+                continue
+            if norm_func is not None:
+                val = norm_func(val)
+                if not val:
+                    continue
+            if val in index:
+                index[val].append(ix)
+            else:
+                index[val] = [ix]
+        return index
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, ix):
+        if ix < 0:
+            ix += self.size
+        if not 0 <= ix < self.size:
+            raise IndexError(ix)
+        return MetadataRow(self, ix)
+
+    def __iter__(self):
+        for ix in range(self.size):
+            yield MetadataRow(self, ix)
+
+    def column(self, col):
+        """Return the values of a column as a list."""
+        return self.columns[col]
+
+    def _lookup(self, index, key):
+        return [MetadataRow(self, ix) for ix in index.get(key, [])]
+
+    def get_by_cord_uid(self, cord_uid):
+        """Return the rows with a given CORD19 UID."""
+        return self._lookup(self.by_cord_uid, cord_uid)
+
+    def get_by_doi(self, doi):
+        """Return the rows with a given DOI, ignoring case and URL prefixes."""
+        doi = fix_doi(doi)
+        return self._lookup(self.by_doi, doi.upper()) if doi else []
+
+    def get_by_pmid(self, pmid):
+        """Return the rows with a given PMID."""
+        return self._lookup(self.by_pmid, pmid)
+
+    def get_by_pmcid(self, pmcid):
+        """Return the rows with a given PMCID."""
+        return self._lookup(self.by_pmcid, pmcid)
+
+
+_metadata_table = None
+_metadata_table_date = None
+_metadata_table_complete = False
+
+
+def get_metadata_table(columns=None):
+    """Return a MetadataTable shared by all callers in the process.
+
+    The table is loaded once per release. If a later call asks for columns
+    not in the loaded table, the table is reloaded with the union of the
+    columns.
+
+    Parameters
+    ----------
+    columns : Optional[list of str]
+        The columns that are needed. Default: all columns
+
+    Returns
+    -------
+    MetadataTable
+        The shared metadata table.
+    """
+    global _metadata_table, _metadata_table_date, _metadata_table_complete
+    date = get_release_date()
+    if _metadata_table is not None and _metadata_table_date == date:
+        loaded = set(_metadata_table.columns)
+        if _metadata_table_complete or \
+                (columns is not None and set(columns) <= loaded):
+            return _metadata_table
+        if columns is not None:
+            columns = sorted(loaded | set(columns))
+    logger.info('Loading metadata table')
+    _metadata_table = MetadataTable(get_metadata_df(columns=columns))
+    _metadata_table_date = date
+    _metadata_table_complete = columns is None
+    return _metadata_table
@@ -0,0 +1,156 @@
+"""Index the statements of an EMMAA model by TextRef.
+
+The index of a model has the hashes of its statements keyed by the TRID of
+their first evidence, the TRIDs of all evidences, and a fingerprint of the
+model. It lets updates find the TextRefs a model already covers without
+going over all of its statements, and is saved as gzipped JSON next to the
+model.
+"""
+import os
+import gzip
+import json
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_model_index_file(model_file):
+    """Return the path to the index stored next to a model pickle."""
+    return '%s.index.json.gz' % model_file.rsplit('.', maxsplit=1)[0]
+
+
+def get_model_fingerprint(stmt_hashes):
+    """Return a fingerprint of a model from the hashes of its statements.
+
+    The fingerprint is the number of statements and the sum of their hashes
+    modulo 2**64, so it doesn't depend on the order of the statements.
+    """
+    count = 0
+    digest = 0
+    for stmt_hash in stmt_hashes:
+        count += 1
+        digest = (digest + stmt_hash) % 2 ** 64
+    return {'count': count, 'digest': digest}
+
+
+def get_model_file_state(model_file):
+    """Return the size and modification time of a model file, which an
+    index saved for the model is checked against when it is loaded."""
+    stat = os.stat(model_file)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def build_model_index(stmts):
+    """Return an index of the statement hashes of a model by TextRef.
+
+    Parameters
+    ----------
+    stmts : iterable of indra.statements.Statement
+        The statements of the model.
+
+    Returns
+    -------
+    dict
+        The index with keys 'hashes_by_trid', the hashes of statements by
+        the TRID of their first evidence, 'known_trids', the set of TRIDs
+        of any evidence, and 'fingerprint', the fingerprint from
+        get_model_fingerprint of the statements with a TRID.
+    """
+    hashes_by_trid = {}
+    known_trids = set()
+    for stmt in stmts:
+        for evid in stmt.evidence:
+            if evid.text_refs.get('TRID'):
+                known_trids.add(evid.text_refs['TRID'])
+        trid = stmt.evidence[0].text_refs.get('TRID') if stmt.evidence \
+            else None
+        if trid is not None:
+            hashes_by_trid.setdefault(trid, []).append(stmt.get_hash())
+    return {'hashes_by_trid': hashes_by_trid, 'known_trids': known_trids,
+            'fingerprint': get_model_fingerprint(
+                stmt_hash for hashes in hashes_by_trid.values()
+                for stmt_hash in hashes)}
+
+
+def update_model_index(model_index, stmts_by_trid):
+    """Replace the statements of some TextRefs in a model index.
+
+    The fingerprint is updated with the hashes of the replaced and of the
+    new statements only, so the cost depends on the size of the update
+    rather than on the size of the model.
+
+    Parameters
+    ----------
+    model_index : dict
+        The index to update in place, from build_model_index or
+        load_model_index.
+    stmts_by_trid : dict
+        The new statements keyed by the TRID of their first evidence, which
+        replace those of the same TextRefs.
+    """
+    count = model_index['fingerprint']['count']
+    digest = model_index['fingerprint']['digest']
+    for trid, stmt_list in stmts_by_trid.items():
+        old_hashes = model_index['hashes_by_trid'].get(trid, [])
+        new_hashes = [stmt.get_hash() for stmt in stmt_list]
+        count += len(new_hashes) - len(old_hashes)
+        digest = (digest + sum(new_hashes) - sum(old_hashes)) % 2 ** 64
+        model_index['hashes_by_trid'][trid] = new_hashes
+        for stmt in stmt_list:
+            for evid in stmt.evidence:
+                if evid.text_refs.get('TRID'):
+                    model_index['known_trids'].add(evid.text_refs['TRID'])
+    model_index['fingerprint'] = {'count': count, 'digest': digest}
+
+
+def save_model_index(model_index, fname, model_file=None):
+    """Save a model index built by build_model_index.
+
+    If a model file is given, its size and modification time are saved
+    with the index, so that the index is only loaded for that file.
+    """
+    model_file_state = get_model_file_state(model_file) if model_file \
+        else None
+    tmp_fname = fname + '.tmp'
+    with gzip.open(tmp_fname, 'wt') as fh:
+        json.dump({'hashes_by_trid': model_index['hashes_by_trid'],
+                   'known_trids': sorted(model_index['known_trids']),
+                   'fingerprint': model_index['fingerprint'],
+                   'model_file_state': model_file_state}, fh)
+    os.replace(tmp_fname, fname)
+
+
+def load_model_index(fname, model_file=None):
+    """Load a model index, or return None if there is no valid one.
+
+    Parameters
+    ----------
+    fname : str
+        The path of the index.
+    model_file : Optional[str]
+        The path of the model the index should describe. If given and the
+        index wasn't saved for this file as it is now, None is returned.
+        This doesn't require reading the model. Default: None
+
+    Returns
+    -------
+    dict or None
+        The index, or None if there is no index matching the model.
+    """
+    if not os.path.exists(fname):
+        return None
+    with gzip.open(fname, 'rt') as fh:
+        model_index = json.load(fh)
+    if model_file is not None and \
+            model_index.get('model_file_state') != \
+            get_model_file_state(model_file):
+        logger.info('The index in %s is not for %s as it is now'
+                    % (fname, model_file))
+        return None
+    # JSON keys are strings, TRIDs are ints
+    model_index['hashes_by_trid'] = {
+        int(trid): hashes for trid, hashes
+        in model_index['hashes_by_trid'].items()}
+    model_index['known_trids'] = set(model_index['known_trids'])
+    return model_index
@@ -0,0 +1,133 @@
+"""Read EMMAA model statements without unpickling EmmaaStatement objects.
+
+A snapshot is a gzipped text sidecar written next to a model pickle. Each
+line has four tab separated fields: the statement hash, the TRID of the
+first evidence, the TRIDs of all evidences (comma separated) and the
+statement JSON. Hashes and TRIDs can be read without parsing statement
+JSONs, and statements can be loaded without reconstructing the EMMAA
+objects wrapping them. Snapshots are only written on request, since
+writing one takes longer than unpickling the model.
+"""
+import os
+import gzip
+import json
+import pickle
+import logging
+from indra.statements import stmts_from_json
+
+
+logger = logging.getLogger(__name__)
+
+
+snapshot_fields = ('hash', 'trid', 'trids', 'stmt')
+
+
+def get_snapshot_file(model_file):
+    """Return the path to the snapshot of a model pickle."""
+    return '%s.snapshot.tsv.gz' % model_file.rsplit('.', maxsplit=1)[0]
+
+
+def get_fresh_snapshot_file(model_file):
+    """Return the path to the snapshot of a model pickle, or None if there
+    is no snapshot at least as recent as the pickle."""
+    fname = get_snapshot_file(model_file)
+    if os.path.exists(fname) and \
+            os.path.getmtime(fname) >= os.path.getmtime(model_file):
+        return fname
+    return None
+
+
+def _get_trids(stmt):
+    return [evid.text_refs['TRID'] for evid in stmt.evidence
+            if evid.text_refs.get('TRID')]
+
+
+def write_model_snapshot(stmts, fname):
+    """Write a snapshot of a list of statements.
+
+    Parameters
+    ----------
+    stmts : list[indra.statements.Statement]
+        The statements of the model.
+    fname : str
+        The path of the snapshot to write.
+    """
+    tmp_fname = fname + '.tmp'
+    with gzip.open(tmp_fname, 'wt', compresslevel=1) as fh:
+        for stmt in stmts:
+            trids = _get_trids(stmt)
+            first_trid = stmt.evidence[0].text_refs.get('TRID') \
+                if stmt.evidence else None
+            fh.write('%s\t%s\t%s\t%s\n' % (
+                stmt.get_hash(), '' if first_trid is None else first_trid,
+                ','.join(str(trid) for trid in trids),
+                json.dumps(stmt.to_json())))
+    os.replace(tmp_fname, fname)
+    logger.info('Wrote snapshot of %d statements to %s' % (len(stmts), fname))
+
+
+def iter_model_snapshot(fname, fields=snapshot_fields):
+    """Iterate over the entries of a snapshot, projected to some fields.
+
+    Parameters
+    ----------
+    fname : str
+        The path of the snapshot.
+    fields : Optional[collection of str]
+        The fields to return out of 'hash' (int), 'trid' (int or None, the
+        TRID of the first evidence), 'trids' (list of int) and 'stmt' (the
+        statement JSON). Statement JSONs are only parsed if 'stmt' is
+        requested. Default: all fields
+
+    Yields
+    ------
+    dict
+        The requested fields of each statement.
+    """
+    parse_stmt = 'stmt' in fields
+    with gzip.open(fname, 'rt') as fh:
+        for line in fh:
+            parts = line.rstrip('\n').split('\t', 3)
+            entry = {}
+            if 'hash' in fields:
+                entry['hash'] = int(parts[0])
+            if 'trid' in fields:
+                entry['trid'] = int(parts[1]) if parts[1] else None
+            if 'trids' in fields:
+                entry['trids'] = [int(trid) for trid in parts[2].split(',')
+                                  if trid]
+            if parse_stmt:
+                entry['stmt'] = json.loads(parts[3])
+            yield entry
+
+
+def load_model_stmts(model_file, write_snapshot=False):
+    """Load the statements of an EMMAA model pickle, using its snapshot if
+    there is an up to date one.
+
+    Parameters
+    ----------
+    model_file : str
+        The path of a pickle of a list of EmmaaStatements.
+    write_snapshot : Optional[bool]
+        If True and there is no up to date snapshot of the model, write one
+        after unpickling the model so that later loads of the same pickle
+        can use it. Writing the snapshot takes longer than unpickling, so
+        this only pays off if the model is loaded again. Default: False
+
+    Returns
+    -------
+    list[indra.statements.Statement]
+        The statements of the model.
+    """
+    fname = get_fresh_snapshot_file(model_file)
+    if fname is not None:
+        logger.info('Loading model statements from %s' % fname)
+        return stmts_from_json([entry['stmt'] for entry
+                                in iter_model_snapshot(fname, ('stmt',))])
+    logger.info('Loading model statements from %s' % model_file)
+    with open(model_file, 'rb') as fh:
+        stmts = [es.stmt for es in pickle.load(fh)]
+    if write_snapshot:
+        write_model_snapshot(stmts, get_snapshot_file(model_file))
+    return stmts
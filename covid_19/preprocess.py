@@ -6,10 +6,17 @@ import time
 import re
 import urllib
 import logging
+import importlib.util
+import io
+import gzip
+import sqlite3
 import tarfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from os.path import abspath, dirname, join, isdir
 import pandas as pd
-from indra.util import zip_string
+from indra.util import zip_string, batch_iter
+from covid_19.download import download_file
 
 
 logger = logging.getLogger(__name__)
@@ -29,17 +36,148 @@ def get_latest_available_date():
     return latest_date
 
 
-latest_date = get_latest_available_date()  # For processing latest data
-# latest_date = '2020-06-15'  # For processing a different date manually
 data_dir = join(dirname(abspath(__file__)), '..', 'data')
-basepath = join(data_dir, latest_date)
-metadata_file = join(basepath, 'metadata.csv')
-doc_gz_path = os.path.join(basepath, 'document_parses.tar.gz')
-doc_df = None
+# The manifest keeps track of the latest known release and of the releases
+# that were downloaded so that the release date can be resolved offline
+manifest_file = join(data_dir, 'releases.json')
+# Environment variable to set the release date to process manually,
+# e.g. CORD19_RELEASE_DATE=2020-06-15
+release_date_env = 'CORD19_RELEASE_DATE'
+# Environment variable to set the number of seconds after which the latest
+# release date is checked again
+release_ttl_env = 'CORD19_RELEASE_TTL'
+default_release_ttl = 24 * 60 * 60
+release_date = None
+text_index = None
+# Unique identifiers by release and identifier type, see get_ids
+_ids_by_type = {}
+
+
+def _load_manifest():
+    if not os.path.exists(manifest_file):
+        return {'latest': None, 'checked': None, 'downloaded': {}}
+    with open(manifest_file, 'r') as fh:
+        return json.load(fh)
+
+
+def _dump_manifest(manifest):
+    if not os.path.exists(data_dir):
+        os.mkdir(data_dir)
+    tmp_file = manifest_file + '.tmp'
+    with open(tmp_file, 'w') as fh:
+        json.dump(manifest, fh, indent=1)
+    os.replace(tmp_file, manifest_file)
+
+
+def _record_download(artifact):
+    manifest = _load_manifest()
+    downloads = manifest['downloaded'].setdefault(get_release_date(), {})
+    downloads[artifact] = time.time()
+    _dump_manifest(manifest)
+
+
+def set_release_date(date):
+    """Set the CORD19 release date to process, e.g. from a CLI argument.
+
+    Parameters
+    ----------
+    date : str or None
+        A release date such as '2020-06-15'. If None, the release date is
+        resolved again the next time it is needed.
+    """
+    global release_date
+    release_date = date
+
+
+def get_release_date(refresh=False):
+    """Return the date of the CORD19 release to process.
+
+    The date is resolved lazily, in order of preference, from
+    set_release_date, the CORD19_RELEASE_DATE environment variable, the
+    local release manifest if it was checked within the TTL, and finally
+    the AI2 website. If the website can't be reached, the latest release
+    in the manifest is used.
+
+    Parameters
+    ----------
+    refresh : Optional[bool]
+        If True, ignore the TTL of the manifest and check the website
+        for the latest release. Default: False
+
+    Returns
+    -------
+    str
+        The release date.
+    """
+    global release_date
+    if release_date:
+        return release_date
+    if os.environ.get(release_date_env):
+        release_date = os.environ[release_date_env]
+        return release_date
+    manifest = _load_manifest()
+    ttl = float(os.environ.get(release_ttl_env, default_release_ttl))
+    if not refresh and manifest['latest'] and manifest['checked'] and \
+            time.time() - manifest['checked'] < ttl:
+        release_date = manifest['latest']
+        return release_date
+    try:
+        latest_date = get_latest_available_date()
+    except Exception as e:
+        if not manifest['latest']:
+            raise
+        logger.warning('Could not get the latest release date (%s), '
+                       'using %s from the manifest.' % (e, manifest['latest']))
+        release_date = manifest['latest']
+        return release_date
+    manifest['latest'] = latest_date
+    manifest['checked'] = time.time()
+    _dump_manifest(manifest)
+    release_date = latest_date
+    return release_date
+
+
+def get_basepath():
+    """Return the data directory of the current release."""
+    return join(data_dir, get_release_date())
+
+
+def get_metadata_file():
+    """Return the path to the metadata file of the current release."""
+    return join(get_basepath(), 'metadata.csv')
+
+
+def get_doc_gz_path():
+    """Return the path to the document parse tarball of the current release."""
+    return join(get_basepath(), 'document_parses.tar.gz')
+
+
+def get_doc_index_path():
+    """Return the path to the full text index of the current release."""
+    return join(get_basepath(), 'document_parses.sqlite')
+
+
+_lazy_attrs = {
+    'latest_date': get_release_date,
+    'basepath': get_basepath,
+    'metadata_file': get_metadata_file,
+    'doc_gz_path': get_doc_gz_path,
+    'doc_index_path': get_doc_index_path,
+}
+
+
+def __getattr__(name):
+    # Resolve release dependent paths only when they are first accessed
+    # so that importing this module doesn't require network access
+    if name in _lazy_attrs:
+        return _lazy_attrs[name]()
+    raise AttributeError('module %s has no attribute %s' % (__name__, name))
 
 
 def download_metadata():
     """Download metadata file only."""
+    basepath = get_basepath()
+    metadata_file = get_metadata_file()
     # Create missing directories
     if not os.path.exists(data_dir):
         os.mkdir(data_dir)
@@ -47,38 +185,308 @@ def download_metadata():
         os.mkdir(basepath)
     if not os.path.exists(metadata_file):
         logger.info('Downloading metadata')
-        md_url = baseurl + '%s/metadata.csv'  % latest_date
-        urllib.request.urlretrieve(md_url, metadata_file)
+        md_url = baseurl + '%s/metadata.csv'  % get_release_date()
+        download_file(md_url, metadata_file)
+        _record_download('metadata')
     logger.info('Latest metadata is available in %s'  % metadata_file)
 
 
 def download_latest_data():
     """Download metadata and document parses."""
     download_metadata()
-    
+    doc_gz_path = get_doc_gz_path()
+
     if not os.path.exists(doc_gz_path):
         logger.info('Downloading document parses')
-        doc_url = baseurl + '%s/document_parses.tar.gz'  % latest_date
-        urllib.request.urlretrieve(doc_url, doc_gz_path)
-    logger.info('Latest data is available in %s'  % basepath)
+        doc_url = baseurl + '%s/document_parses.tar.gz'  % get_release_date()
+        download_file(doc_url, doc_gz_path)
+        _record_download('document_parses')
+    logger.info('Latest data is available in %s'  % get_basepath())
+
+
+def _iter_members(filenames=None):
+    """Iterate over the names and raw contents of document json files."""
+    if filenames is not None:
+        filenames = set(filenames)
+        if not filenames:
+            return
+    # Open the tarball in streaming mode so that members are never indexed
+    # or held in memory all at once
+    with tarfile.open(get_doc_gz_path(), mode='r|gz') as tar:
+        for m in tar:
+            if not m.isfile():
+                continue
+            if filenames is not None:
+                if m.name not in filenames:
+                    continue
+                filenames.discard(m.name)
+            yield m.name, tar.extractfile(m).read()
+            # Stop reading the archive once everything asked for is found
+            if filenames is not None and not filenames:
+                break
+
+
+def _extract_texts(members):
+    """Return full texts for a list of json filenames and raw contents."""
+    return [(name, get_text_from_json(json.loads(content.decode('utf-8'))))
+            for name, content in members]
+
+
+def iter_texts(filenames=None, n_proc=None, chunk_size=100, ordered=True):
+    """Iterate over full texts extracted from the document json files.
+
+    Members of the document parse tarball are read one at a time so that
+    memory use does not depend on the size of the corpus.
+
+    Parameters
+    ----------
+    filenames : Optional[collection of str]
+        If given, only members with these names are extracted, all other
+        members are skipped without being decompressed into memory.
+    n_proc : Optional[int]
+        If larger than 1, json parsing and text extraction is done in a pool
+        of this many worker processes. Default: None (serial extraction)
+    chunk_size : Optional[int]
+        The number of json files sent to a worker process at a time.
+        Default: 100
+    ordered : Optional[bool]
+        If True, texts are yielded in the order of the members in the
+        tarball, otherwise in the order in which the workers finish.
+        Only used if n_proc is larger than 1. Default: True
+
+    Yields
+    ------
+    tuple of str
+        Pairs of json filename (tar member name) and extracted full text.
+    """
+    members = _iter_members(filenames)
+    if not n_proc or n_proc <= 1:
+        for name, content in members:
+            yield from _extract_texts([(name, content)])
+        return
+    # Keep a bounded number of chunks in flight so that reading the tarball
+    # does not run ahead of the workers
+    max_pending = 2 * n_proc
+    with ProcessPoolExecutor(max_workers=n_proc) as executor:
+        pending = deque()
+        for chunk in batch_iter(members, chunk_size):
+            pending.append(executor.submit(_extract_texts, list(chunk)))
+            while len(pending) >= max_pending:
+                if ordered:
+                    yield from pending.popleft().result()
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        pending.remove(future)
+                        yield from future.result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def get_json_filenames_for_entry(md_entry):
+    """Return the names of the json files for a metadata entry."""
+    filenames = []
+    if md_entry['pdf_json_files']:
+        filenames += [s.strip() for s in md_entry['pdf_json_files'].split(';')]
+    if md_entry['pmc_json_files']:
+        filenames.append(md_entry['pmc_json_files'])
+    return filenames
+
+
+def get_texts_for_entries(md_entries):
+    """Return a dictionary of full texts only for the given metadata entries.
+
+    Parameters
+    ----------
+    md_entries : iterable of dict
+        CORD19 metadata entries whose pdf_json_files and pmc_json_files
+        determine which json files are extracted.
+
+    Returns
+    -------
+    dict
+        A dictionary mapping json filenames with full text contents.
+    """
+    filenames = {fname for md_entry in md_entries
+                 for fname in get_json_filenames_for_entry(md_entry)}
+    logger.info('Extracting full texts from %d document json files...'
+                % len(filenames))
+    return dict(iter_texts(filenames))
+
+
+def get_all_texts(n_proc=None):
+    """Return a dictionary mapping json filenames with full text contents.
 
+    Note that this holds the text of the entire corpus in memory, use
+    iter_texts or get_texts_for_entries where possible.
 
-def get_all_texts():
-    """Return a dictionary mapping json filenames with full text contents."""
-    texts_by_file = {}
+    Parameters
+    ----------
+    n_proc : Optional[int]
+        The number of processes to extract texts with. Default: None
+    """
     logger.info('Extracting full texts from all document json files...')
-    tar = tarfile.open(doc_gz_path)
-    members = tar.getmembers()
-    for m in members:
-        f = tar.extractfile(m)
-        doc_json = json.loads(f.read().decode('utf-8'))
-        text = get_text_from_json(doc_json)
-        texts_by_file[m.name] = text
-    tar.close()
-    return texts_by_file
-
-
-def get_zip_texts_for_entry(md_entry, texts_by_file, zip=True):
+    return dict(iter_texts(n_proc=n_proc))
+
+
+class TextIndex(object):
+    """A random-access store of full texts keyed by json filename.
+
+    The store is an SQLite file built once from the document parse tarball
+    by build_text_index. It supports the dict-like lookups used on the
+    output of get_all_texts so it can be used in its place.
+
+    Parameters
+    ----------
+    path : str
+        Path to the SQLite file of the index.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+
+    def get(self, filename, default=None):
+        row = self.conn.execute('SELECT text FROM texts WHERE filename = ?',
+                                (filename,)).fetchone()
+        return row[0] if row is not None else default
+
+    def __getitem__(self, filename):
+        text = self.get(filename)
+        if text is None:
+            raise KeyError(filename)
+        return text
+
+    def __contains__(self, filename):
+        return self.get(filename) is not None
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM texts').fetchone()[0]
+
+    def __iter__(self):
+        for (filename,) in self.conn.execute('SELECT filename FROM texts'):
+            yield filename
+
+    def close(self):
+        self.conn.close()
+
+
+def _get_tarball_signature():
+    stat = os.stat(get_doc_gz_path())
+    return str(stat.st_size), str(int(stat.st_mtime))
+
+
+def _get_index_signature(path):
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute('SELECT key, value FROM info').fetchall()
+    except sqlite3.DatabaseError:
+        return None
+    finally:
+        conn.close()
+    info = dict(rows)
+    return info.get('tar_size'), info.get('tar_mtime')
+
+
+def _write_text_index(path, texts, info):
+    # Write to a temporary file first so that an interrupted build never
+    # leaves behind an index that looks complete
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    conn.execute('CREATE TABLE texts (filename TEXT PRIMARY KEY, text TEXT)')
+    conn.execute('CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT)')
+    count = 0
+    batch = []
+    for filename, text in texts:
+        batch.append((filename, text))
+        if len(batch) == 1000:
+            conn.executemany('INSERT OR REPLACE INTO texts VALUES (?, ?)',
+                             batch)
+            count += len(batch)
+            batch = []
+    conn.executemany('INSERT OR REPLACE INTO texts VALUES (?, ?)', batch)
+    count += len(batch)
+    conn.executemany('INSERT INTO info VALUES (?, ?)', list(info.items()))
+    conn.commit()
+    conn.close()
+    os.replace(tmp_path, path)
+    logger.info('Indexed %d document json files' % count)
+
+
+def build_text_index(force=False, n_proc=None, filenames=None):
+    """Extract full texts from the tarball into an on-disk index.
+
+    The index of all full texts is only rebuilt if the size or modification
+    time of the tarball changed since it was last built, unless force is
+    True.
+
+    Parameters
+    ----------
+    force : Optional[bool]
+        If True, rebuild the index even if it is up to date. Default: False
+    n_proc : Optional[int]
+        The number of processes to extract texts with. Default: None
+    filenames : Optional[collection of str]
+        If given, only these json files are indexed, e.g. those of the
+        documents in a release diff. Such an index is written to a separate
+        file next to the index of all texts and is rebuilt every time.
+        Default: None
+
+    Returns
+    -------
+    str
+        The path to the index file.
+    """
+    if filenames is not None:
+        doc_index_path = join(get_basepath(), 'document_parses_subset.sqlite')
+        logger.info('Building text index of %d document json files in %s'
+                    % (len(filenames), doc_index_path))
+        _write_text_index(doc_index_path,
+                          iter_texts(filenames, n_proc=n_proc, ordered=False),
+                          {})
+        return doc_index_path
+    doc_index_path = get_doc_index_path()
+    signature = _get_tarball_signature()
+    if not force and os.path.exists(doc_index_path) and \
+            _get_index_signature(doc_index_path) == signature:
+        logger.info('Text index in %s is up to date' % doc_index_path)
+        return doc_index_path
+    logger.info('Building text index in %s' % doc_index_path)
+    _write_text_index(doc_index_path,
+                      iter_texts(n_proc=n_proc, ordered=False),
+                      {'tar_size': signature[0], 'tar_mtime': signature[1]})
+    return doc_index_path
+
+
+def get_text_index():
+    """Return a TextIndex over the full texts, building it if necessary."""
+    global text_index
+    if text_index is None or text_index.path != get_doc_index_path():
+        text_index = TextIndex(build_text_index())
+    return text_index
+
+
+def get_zip_texts_for_entry(md_entry, texts_by_file=None, zip=True):
+    """Return the text content entries for a metadata entry.
+
+    Parameters
+    ----------
+    md_entry : dict
+        A CORD19 metadata entry.
+    texts_by_file : Optional[dict or TextIndex]
+        A mapping of json filenames to full texts. If not given, the on-disk
+        text index is used.
+    zip : Optional[bool]
+        If True, texts are compressed with zip_string. Default: True
+
+    Returns
+    -------
+    list of tuple
+        Tuples of source, text type and (compressed) text.
+    """
+    if texts_by_file is None:
+        texts_by_file = get_text_index()
     texts = []
     if md_entry['pdf_json_files']:
         filenames = [s.strip() for s in md_entry['pdf_json_files'].split(';')]
@@ -109,45 +517,162 @@ def get_zip_texts_for_entry(md_entry, texts_by_file, zip=True):
     return texts
 
 
-def get_metadata_df():
-    file_data = []
-    hashes = []
+def zip_text(text, level=None):
+    """Return a text gzip-compressed like zip_string at a given level.
+
+    Parameters
+    ----------
+    text : str
+        The text to compress.
+    level : Optional[int]
+        The compression level from 1 to 9. Default: None, which uses
+        zip_string as is.
+
+    Returns
+    -------
+    bytes
+        The compressed text.
+    """
+    if level is None:
+        return zip_string(text)
+    buf = io.BytesIO()
+    with gzip.GzipFile('gzipped_object', 'wb', level, buf) as gzf:
+        gzf.write(text.encode('utf8'))
+    return buf.getvalue()
+
+
+def zip_texts(texts, level=None):
+    """Compress a list of texts, e.g. in a worker process.
+
+    Parameters
+    ----------
+    texts : list of str
+        The texts to compress.
+    level : Optional[int]
+        The compression level, see zip_text.
+
+    Returns
+    -------
+    zipped : list of bytes
+        The compressed texts.
+    elapsed : float
+        The number of seconds spent compressing.
+    """
+    ts = time.time()
+    zipped = [zip_text(text, level) for text in texts]
+    return zipped, time.time() - ts
+
+
+# Columns with few distinct values are stored as categoricals to save memory
+metadata_dtypes = {
+    'cord_uid': 'object',
+    'sha': 'object',
+    'source_x': 'category',
+    'title': 'object',
+    'doi': 'object',
+    'pmcid': 'object',
+    'pubmed_id': 'object',
+    'license': 'category',
+    'abstract': 'object',
+    'publish_time': 'object',
+    'authors': 'object',
+    'journal': 'category',
+    'mag_id': 'object',
+    'who_covidence_id': 'object',
+    'arxiv_id': 'object',
+    'pdf_json_files': 'object',
+    'pmc_json_files': 'object',
+    'url': 'object',
+    's2_id': 'object',
+}
+
+
+def get_metadata_cache_path():
+    """Return the path to the columnar metadata cache of the current release."""
+    return join(get_basepath(), 'metadata.parquet')
+
+
+def _read_metadata_csv(columns=None):
+    dtype_dict = metadata_dtypes if columns is None else \
+        {col: metadata_dtypes[col] for col in columns
+         if col in metadata_dtypes}
+    parse_dates = ['publish_time'] \
+        if columns is None or 'publish_time' in columns else False
+    return pd.read_csv(get_metadata_file(), dtype=dtype_dict,
+                       usecols=columns, parse_dates=parse_dates)
+
+
+def build_metadata_cache(force=False):
+    """Convert the metadata file into a columnar Parquet cache.
+
+    The cache is stored next to the metadata file of the release and is
+    only rebuilt if it is older than the metadata file, unless force is True.
+    Building the cache requires pyarrow to be installed.
+
+    Parameters
+    ----------
+    force : Optional[bool]
+        If True, rebuild the cache even if it is up to date. Default: False
+
+    Returns
+    -------
+    str or None
+        The path to the cache file, or None if the cache can't be built.
+    """
+    if importlib.util.find_spec('pyarrow') is None:
+        logger.info('pyarrow is not available, not caching metadata')
+        return None
+    cache_path = get_metadata_cache_path()
+    if not force and os.path.exists(cache_path) and \
+            os.path.getmtime(cache_path) >= \
+            os.path.getmtime(get_metadata_file()):
+        return cache_path
+    logger.info('Caching metadata in %s' % cache_path)
+    md = _read_metadata_csv()
+    tmp_path = cache_path + '.tmp'
+    md.to_parquet(tmp_path, engine='pyarrow', index=False)
+    os.replace(tmp_path, cache_path)
+    return cache_path
+
+
+def get_metadata_df(columns=None):
+    """Return the CORD19 metadata as a data frame.
+
+    The metadata is read from the columnar cache when available, which is
+    much faster than parsing the CSV file and allows loading only some of
+    the columns.
+
+    Parameters
+    ----------
+    columns : Optional[list of str]
+        The columns to load, e.g. ['cord_uid', 'doi']. Default: all columns
+
+    Returns
+    -------
+    pandas.DataFrame
+        The metadata with compact dtypes (see metadata_dtypes), missing
+        values are None or NaN depending on the dtype.
     """
-    for content_type, content_path in paths.items():
-        for filename in os.listdir(content_path):
-            if filename.endswith('.json'):
-                file_hash = filename.split('.')[0]
-                hashes.append(file_hash)
-                file_data.append((content_path, content_type))
-    file_df = pd.DataFrame(file_data, index=hashes, dtype='str',
-                           columns=['content_path', 'content_type'])
+    if columns is not None:
+        columns = list(columns)
+    cache_path = build_metadata_cache()
+    if cache_path:
+        return pd.read_parquet(cache_path, engine='pyarrow', columns=columns)
+    return _read_metadata_csv(columns)
+
+
+def _nulls_to_none(md):
+    """Replace missing values with None in all but date columns.
+
+    Date columns such as publish_time keep NaT for missing dates, as
+    callers use date attributes like .year and NaT has them.
     """
-    dtype_dict = {
-            'cord_uid': 'object',
-            'sha': 'object',
-            'source_x': 'object',
-            'title': 'object',
-            'doi': 'object',
-            'pmcid': 'object',
-            'pubmed_id': 'object',
-            'license': 'object',
-            'abstract': 'object',
-            'publish_time': 'object',
-            'authors': 'object',
-            'journal': 'object',
-            'mag_id': 'object',
-            'who_covidence_id': 'object',
-            'arxiv_id': 'object',
-            'pdf_json_files': 'object',
-            'pmc_json_files': 'object',
-            'url': 'object',
-            's2_id': 'object',
-    }
-    md = pd.read_csv(metadata_file, dtype=dtype_dict,
-                           parse_dates=['publish_time'])
-    md = md.where(md.notnull(), None)
-    #file_data = metadata.join(file_df, 'sha')
-    #return file_data
+    md = md.copy()
+    for col in md.columns:
+        if pd.api.types.is_datetime64_any_dtype(md[col]):
+            continue
+        md[col] = md[col].astype('object')
+        md[col] = md[col].where(md[col].notnull(), None)
     return md
 
 
@@ -164,11 +689,14 @@ def get_ids(id_type):
     list of str
         List of unique identifiers in the dataset, e.g. all unique PMCIDs.
     """
-    global doc_df
-    if doc_df is None:
-        doc_df = get_metadata_df()
-    unique_ids = list(doc_df[~pd.isna(doc_df[id_type])][id_type].unique())
-    return unique_ids
+    # The identifiers are kept in memory since without the Parquet cache
+    # each call would parse the metadata CSV again
+    key = (get_release_date(), id_type)
+    if key not in _ids_by_type:
+        id_df = get_metadata_df(columns=[id_type])
+        _ids_by_type[key] = \
+            list(id_df[~pd.isna(id_df[id_type])][id_type].unique())
+    return list(_ids_by_type[key])
 
 
 def get_text_from_json(doc_json):
@@ -226,8 +754,8 @@ def dump_text_files(output_dir, doc_df):
     doc_df.to_csv(join(output_dir, 'metadata.csv'))
 
 
-def get_metadata_dict():
-    df = get_metadata_df()
+def get_metadata_dict(columns=None):
+    df = _nulls_to_none(get_metadata_df(columns=columns))
     return df.to_dict(orient='records')
 
 
@@ -249,18 +777,21 @@ def fix_pmid(pmid):
     return pmid
 
 
+# Metadata columns mapped to the text ref keys they are stored under
+text_ref_mappings = {
+    'cord_uid': 'CORD19_UID',
+    'sha': 'CORD19_SHA',
+    'doi': 'DOI',
+    'pmcid': 'PMCID',
+    'pubmed_id': 'PMID',
+    'who_covidence_id': 'WHO_COVIDENCE',
+    'mag_id': 'MICROSOFT'
+}
+
+
 def get_text_refs_from_metadata(entry):
-    mappings = {
-        'cord_uid': 'CORD19_UID',
-        'sha': 'CORD19_SHA',
-        'doi': 'DOI',
-        'pmcid': 'PMCID',
-        'pubmed_id': 'PMID',
-        'who_covidence_id': 'WHO_COVIDENCE',
-        'mag_id': 'MICROSOFT'
-    }
     text_refs = {}
-    for key, ref_key in mappings.items():
+    for key, ref_key in text_ref_mappings.items():
         val = entry.get(key)
         if key == 'doi':
             val = fix_doi(val)
@@ -273,3 +804,86 @@ def get_text_refs_from_metadata(entry):
             text_refs[ref_key] = val
     return text_refs
 
+
+def _fix_text_ref_column(key, vals):
+    # Normalize the values of a metadata column in one pass as
+    # get_text_refs_from_metadata does, with None for missing values
+    if key == 'pubmed_id':
+        return [val if isinstance(val, str) and val.isdigit() else None
+                for val in vals]
+    if key == 'doi':
+        vals = [fix_doi(val) if isinstance(val, str) else None
+                for val in vals]
+    # Temporary patch to remove float suffixes
+    return [(val[:-2] if val.endswith('.0') else val)
+            if isinstance(val, str) and val else None for val in vals]
+
+
+def _get_text_ref_columns(md_entries):
+    # Return the normalized text ref columns of a data frame or a
+    # MetadataTable by text ref key, skipping missing columns
+    if isinstance(md_entries, pd.DataFrame):
+        columns = {key: md_entries[key].tolist()
+                   for key in text_ref_mappings if key in md_entries.columns}
+    else:
+        columns = {key: md_entries.column(key)
+                   for key in text_ref_mappings if key in md_entries.columns}
+    return {ref_key: _fix_text_ref_column(key, columns[key])
+            for key, ref_key in text_ref_mappings.items() if key in columns}
+
+
+def get_text_refs_df(md_df):
+    """Return the text refs for all entries of a metadata data frame.
+
+    This gives the same results as get_text_refs_from_metadata applied to
+    each row.
+
+    Parameters
+    ----------
+    md_df : pandas.DataFrame
+        A data frame of CORD19 metadata.
+
+    Returns
+    -------
+    pandas.DataFrame
+        A data frame aligned with md_df with a column for each text ref key
+        (e.g. DOI, PMID) and None wherever the entry doesn't have that
+        text ref.
+    """
+    ref_columns = _get_text_ref_columns(md_df)
+    return pd.DataFrame({ref_key: ref_columns.get(ref_key,
+                                                  [None] * len(md_df))
+                         for ref_key in text_ref_mappings.values()},
+                        index=md_df.index, dtype='object')
+
+
+def get_text_refs_for_entries(md_entries):
+    """Return the text refs for a list of metadata entries.
+
+    The columns of a data frame or a MetadataTable are normalized one at a
+    time, other entries are processed one by one with
+    get_text_refs_from_metadata.
+
+    Parameters
+    ----------
+    md_entries : list of dict or pandas.DataFrame or MetadataTable
+        CORD19 metadata entries, e.g. from get_metadata_dict or a
+        MetadataTable, or a metadata data frame.
+
+    Returns
+    -------
+    list of dict
+        Text ref dictionaries in the order of the entries, identical to
+        those returned by get_text_refs_from_metadata.
+    """
+    if not isinstance(md_entries, pd.DataFrame) and \
+            not isinstance(getattr(md_entries, 'columns', None), dict):
+        return [get_text_refs_from_metadata(entry) for entry in md_entries]
+    all_text_refs = [{} for _ in range(len(md_entries))]
+    # Adding one column at a time keeps the key order of
+    # get_text_refs_from_metadata
+    for ref_key, vals in _get_text_ref_columns(md_entries).items():
+        for text_refs, val in zip(all_text_refs, vals):
+            if val is not None:
+                text_refs[ref_key] = val
+    return all_text_refs
@@ -6,6 +6,7 @@ from collections import defaultdict
 from indra.tools import assemble_corpus as ac
 from emmaa.model import get_assembled_statements
 from emmaa.model_tests import load_tests_from_s3
+from covid_19 import stmt_store
 
 
 logger = logging.getLogger(__name__)
@@ -84,9 +85,9 @@ if __name__ == '__main__':
         [test.stmt for test in mitre_tests]
 
     # Load CTD statements
-    chem_dis_stmts = ac.load_statements(args.chemical_disease)
-    chem_gene_stmts = ac.load_statements(args.chemical_gene)
-    gene_dis_stmts = ac.load_statements(args.gene_disease)
+    chem_dis_stmts = stmt_store.load_statements(args.chemical_disease)
+    chem_gene_stmts = stmt_store.load_statements(args.chemical_gene)
+    gene_dis_stmts = stmt_store.load_statements(args.gene_disease)
     all_ctd_stmts = chem_dis_stmts + chem_gene_stmts + gene_dis_stmts
 
     # Collect most frequents gene groundings for model statements and
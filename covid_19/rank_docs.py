@@ -1,18 +1,25 @@
+import os
 import csv
+import gzip
+import json
 import argparse
+from bisect import bisect_left
+from functools import lru_cache
+from os.path import join
 from tabulate import tabulate
 from indra.literature import crossref_client, pubmed_client
 from indra.preassembler import Preassembler
 from indra.ontology.bio import bio_ontology
-from indra.tools import assemble_corpus as ac
+from indra import __version__ as indra_version
 from indra.databases.mesh_client import mesh_id_to_tree_numbers, get_mesh_name
 from indra_db import get_db
-from covid_19.emmaa_update import stmts_by_text_refs
-from covid_19.preprocess import get_metadata_dict
+from covid_19.emmaa_update import group_grounded_stmts, iter_stmts_from_file
+from covid_19.preprocess import data_dir, set_release_date
+from covid_19.metadata import get_metadata_table
 
-_cord_by_doi = {}
-_cord_by_pmid = {}
 _mesh_tree_to_id = {}
+_mesh_tree_index = None
+mesh_tree_index_file = join(data_dir, 'mesh_tree_index.json.gz')
 
 
 def get_mesh_tree_to_id():
@@ -24,28 +31,67 @@ def get_mesh_tree_to_id():
     return _mesh_tree_to_id
 
 
-def get_mesh_children(mesh_id):
-    parent_tns = mesh_id_to_tree_numbers[mesh_id]
-    children = []
+def _get_mesh_tree_index_key():
+    # The index is rebuilt if the MeSH resources of INDRA may have changed
+    return '%s:%d' % (indra_version, len(mesh_id_to_tree_numbers))
+
+
+def get_mesh_tree_index():
+    """Return all MeSH tree numbers in sorted order and their MeSH IDs.
+
+    The index is built once and cached in the data directory.
+
+    Returns
+    -------
+    tree_numbers : list[str]
+        The sorted MeSH tree numbers.
+    mesh_ids : list[str]
+        The MeSH ID of each tree number.
+    """
+    global _mesh_tree_index
+    if _mesh_tree_index is not None:
+        return _mesh_tree_index
+    key = _get_mesh_tree_index_key()
+    if os.path.exists(mesh_tree_index_file):
+        with gzip.open(mesh_tree_index_file, 'rt') as fh:
+            index = json.load(fh)
+        if index['key'] == key:
+            _mesh_tree_index = (index['tree_numbers'], index['mesh_ids'])
+            return _mesh_tree_index
     mesh_tree_to_id = get_mesh_tree_to_id()
-    for parent_tn in parent_tns:
-        for tn, m_id in mesh_tree_to_id.items():
-            if tn.startswith(parent_tn):
-                children.append(m_id)
-    return children
+    tree_numbers = sorted(mesh_tree_to_id)
+    mesh_ids = [mesh_tree_to_id[tn] for tn in tree_numbers]
+    if os.path.exists(data_dir):
+        tmp_fname = mesh_tree_index_file + '.tmp'
+        with gzip.open(tmp_fname, 'wt') as fh:
+            json.dump({'key': key, 'tree_numbers': tree_numbers,
+                       'mesh_ids': mesh_ids}, fh)
+        os.replace(tmp_fname, mesh_tree_index_file)
+    _mesh_tree_index = (tree_numbers, mesh_ids)
+    return _mesh_tree_index
+
+
+@lru_cache(maxsize=None)
+def _get_mesh_children(mesh_id):
+    tree_numbers, mesh_ids = get_mesh_tree_index()
+    children = []
+    for parent_tn in mesh_id_to_tree_numbers[mesh_id]:
+        # Tree numbers starting with the parent's form a contiguous range of
+        # the sorted tree numbers, tree numbers are ASCII so any of them
+        # starting with the parent's sorts before parent_tn + DEL
+        start = bisect_left(tree_numbers, parent_tn)
+        end = bisect_left(tree_numbers, parent_tn + '\x7f', start)
+        children += mesh_ids[start:end]
+    return tuple(children)
+
+
+def get_mesh_children(mesh_id):
+    return list(_get_mesh_children(mesh_id))
 
 
 def get_cord_info():
-    global _cord_by_doi
-    global _cord_by_pmid
-    if not (_cord_by_doi and _cord_by_pmid):
-        cord_md = get_metadata_dict()
-        for md_entry in cord_md:
-            if md_entry.get('doi'):
-                _cord_by_doi[md_entry['doi'].upper()] = md_entry
-            if md_entry.get('pubmed_id'):
-                _cord_by_pmid[md_entry['pubmed_id']] = md_entry
-    return (_cord_by_doi, _cord_by_pmid)
+    return get_metadata_table(columns=['doi', 'pubmed_id', 'title',
+                                       'authors', 'journal', 'publish_time'])
 
 
 def get_pmids_for_mesh_terms(mesh_list):
@@ -58,13 +104,14 @@ def get_pmids_for_mesh_terms(mesh_list):
 
 
 def get_tr_metadata(ev_tr_dict):
-    cord_by_doi, cord_by_pmid = get_cord_info()
+    cord_md = get_cord_info()
     # If has DOI, look up in CORD19
     title, authors, journal, date = (None, None, None, None)
     if ev_tr_dict.get('DOI'):
         doi = ev_tr_dict['DOI']
-        cord_entry = cord_by_doi.get(doi)
-        if cord_entry:
+        cord_entries = cord_md.get_by_doi(doi)
+        if cord_entries:
+            cord_entry = cord_entries[-1]
             return (cord_entry['title'], cord_entry['authors'],
                     cord_entry['journal'], cord_entry['publish_time'].year)
         # Article not in CORD-19 corpus, get metadata from Crossref
@@ -92,8 +139,9 @@ def get_tr_metadata(ev_tr_dict):
     # If we got here, then we haven't found the metadata yet, try by PMID
     if ev_tr_dict.get('PMID'):
         pmid = ev_tr_dict['PMID']
-        cord_entry = cord_by_pmid.get(pmid)
-        if cord_entry:
+        cord_entries = cord_md.get_by_pmid(pmid)
+        if cord_entries:
+            cord_entry = cord_entries[-1]
             return (cord_entry['title'], cord_entry['authors'],
                     cord_entry['journal'], cord_entry['publish_time'].year)
         print("Querying Pubmed")
@@ -171,14 +219,20 @@ if __name__ == '__main__':
                         required=True)
     parser.add_argument('-o', '--output_base',
                         help='Basename for output files.', required=True)
+    parser.add_argument('-r', '--release_date',
+                        help='CORD19 release date to use, e.g. 2020-06-15 '
+                             '(optional, default: latest release)',
+                        required=False)
+    parser.add_argument('-n', '--n_proc', type=int,
+                        help='Number of processes to filter and group '
+                             'statements with (optional)',
+                        required=False)
     args = parser.parse_args()
+    set_release_date(args.release_date)
 
-    # Load statements and filter to grounded only
-    stmts = ac.load_statements(args.input_file)
-    stmts = ac.filter_grounded_only(stmts)
-
-    # Sort by TextRefs
-    by_tr, no_tr = stmts_by_text_refs(stmts)
+    # Load statements, filter to grounded only and sort by TextRefs
+    by_tr, no_tr = group_grounded_stmts(iter_stmts_from_file(args.input_file),
+                                        n_proc=args.n_proc)
 
     # Combine duplicates in each statement list
     by_tr_pa = {}
@@ -0,0 +1,180 @@
+"""Compare CORD19 releases to find the documents that were added or changed,
+so that downstream processing can be limited to the delta.
+
+The state of a release is a fingerprint of the identifiers, parse files and
+content of each CORD19 document (by cord_uid), stored next to the metadata
+of the release.
+"""
+import os
+import gzip
+import json
+import logging
+from collections import namedtuple
+from os.path import join
+import pandas as pd
+from covid_19.preprocess import data_dir, get_release_date, metadata_dtypes
+
+
+logger = logging.getLogger(__name__)
+
+
+# The metadata columns which, if changed, require a document to be
+# processed again
+fingerprint_columns = ['sha', 'doi', 'pmcid', 'pubmed_id', 'title',
+                       'abstract', 'pdf_json_files', 'pmc_json_files']
+
+
+# Documents removed from a release are only counted, content and
+# statements of removed documents are kept
+ReleaseDiff = namedtuple('ReleaseDiff', ['old_date', 'new_date', 'added',
+                                         'changed'])
+
+
+def get_release_state_file(date):
+    """Return the path to the state file of a given release."""
+    return join(data_dir, date, 'release_state.json.gz')
+
+
+def _get_release_metadata(date):
+    columns = ['cord_uid'] + fingerprint_columns
+    return pd.read_csv(join(data_dir, date, 'metadata.csv'),
+                       usecols=columns,
+                       dtype={col: metadata_dtypes[col] for col in columns})
+
+
+def get_release_state(md_df):
+    """Return a fingerprint for each document in a metadata data frame.
+
+    Parameters
+    ----------
+    md_df : pandas.DataFrame
+        CORD19 metadata with at least the cord_uid and fingerprint_columns
+        columns.
+
+    Returns
+    -------
+    dict
+        A dictionary mapping cord_uids to integer fingerprints. Rows with
+        the same cord_uid are combined into one fingerprint.
+    """
+    fields = md_df[fingerprint_columns].astype('object')
+    fields = fields.where(fields.notnull(), '')
+    hashes = pd.util.hash_pandas_object(fields, index=False)
+    state = {}
+    for cord_uid, row_hash in zip(md_df['cord_uid'], hashes.tolist()):
+        if cord_uid in state:
+            # Combine duplicate entries independently of their order
+            state[cord_uid] = (state[cord_uid] + row_hash) % 2**64
+        else:
+            state[cord_uid] = row_hash
+    return state
+
+
+def save_release_state(date, state):
+    """Save the state of a release to its state file."""
+    fname = get_release_state_file(date)
+    tmp_fname = fname + '.tmp'
+    with gzip.open(tmp_fname, 'wt') as fh:
+        json.dump(state, fh)
+    os.replace(tmp_fname, fname)
+
+
+def load_release_state(date):
+    """Return the state of a release, computing and saving it if needed.
+
+    Parameters
+    ----------
+    date : str
+        The date of the release, whose metadata.csv must be available
+        in the data directory if the state was not saved before.
+
+    Returns
+    -------
+    dict
+        A dictionary mapping cord_uids to integer fingerprints.
+    """
+    fname = get_release_state_file(date)
+    if os.path.exists(fname):
+        with gzip.open(fname, 'rt') as fh:
+            return json.load(fh)
+    logger.info('Computing the state of release %s' % date)
+    state = get_release_state(_get_release_metadata(date))
+    save_release_state(date, state)
+    return state
+
+
+def get_previous_release(date):
+    """Return the latest release before a given date available locally.
+
+    Parameters
+    ----------
+    date : str
+        The date of the release to look before.
+
+    Returns
+    -------
+    str or None
+        The date of the latest earlier release with a saved state or a
+        metadata file in the data directory, or None if there isn't one.
+    """
+    if not os.path.exists(data_dir):
+        return None
+    earlier = sorted(
+        d for d in os.listdir(data_dir) if d < date and
+        (os.path.exists(get_release_state_file(d)) or
+         os.path.exists(join(data_dir, d, 'metadata.csv'))))
+    return earlier[-1] if earlier else None
+
+
+def diff_releases(new_date=None, old_date=None):
+    """Return the documents added and changed between two releases.
+
+    Parameters
+    ----------
+    new_date : Optional[str]
+        The date of the new release. Default: the current release.
+    old_date : Optional[str]
+        The date of the old release. Default: the latest earlier release
+        available locally.
+
+    Returns
+    -------
+    ReleaseDiff
+        The dates compared and the sets of added and changed cord_uids. If
+        there is no earlier release, all documents of the new release are
+        considered added. The number of removed documents is only logged.
+    """
+    if new_date is None:
+        new_date = get_release_date()
+    if old_date is None:
+        old_date = get_previous_release(new_date)
+    new_state = load_release_state(new_date)
+    old_state = load_release_state(old_date) if old_date else {}
+    added = set(new_state) - set(old_state)
+    n_removed = len(set(old_state) - set(new_state))
+    changed = {cord_uid for cord_uid, fingerprint in new_state.items()
+               if cord_uid in old_state and
+               old_state[cord_uid] != fingerprint}
+    logger.info('Release %s compared to %s: %d added, %d changed, '
+                '%d removed' % (new_date, old_date, len(added),
+                                len(changed), n_removed))
+    return ReleaseDiff(old_date, new_date, added, changed)
+
+
+def filter_metadata_to_diff(md, diff):
+    """Return the metadata entries that were added or changed in a diff.
+
+    Parameters
+    ----------
+    md : iterable of dict
+        CORD19 metadata entries, e.g. from a MetadataTable.
+    diff : ReleaseDiff
+        The release diff to filter to.
+
+    Returns
+    -------
+    list of dict
+        The entries whose cord_uid was added or changed.
+    """
+    cord_uids = diff.added | diff.changed
+    return [entry for entry in md if entry['cord_uid'] in cord_uids]
@@ -0,0 +1,226 @@
+"""Resolve CORD19 identifiers to INDRA DB TextRefs in a single round trip.
+
+The PMID, PMCID and DOI of each CORD19 article are loaded into a temporary
+table (with COPY on Postgres), and the matching TextRefs are found with one
+query joining the temporary table to the text_ref table on each indexed
+identifier column. As in TextRef.pmid_in, pmcid_in and doi_in, these are
+the numeric pmid_num and pmcid_num columns and the doi_ns and doi_id
+columns of the upper case DOI, so identifiers are normalized the same way
+before they are loaded. Results are streamed with a server-side cursor on
+Postgres.
+
+The functions work on DB-API connections so that an SQLite database created
+with create_text_ref_table can stand in for the INDRA DB, e.g. to test or
+benchmark the resolution locally.
+"""
+import io
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+text_ref_id_types = ('pmid', 'pmcid', 'doi', 'pii', 'url', 'manuscript_id')
+
+
+def _is_sqlite(conn):
+    return type(conn).__module__.startswith('sqlite3')
+
+
+def _get_pmid_num(pmid):
+    """Return the number of a PMID, or None if it isn't valid."""
+    try:
+        return int(pmid)
+    except (TypeError, ValueError):
+        return None
+
+
+def _get_pmcid_num(pmcid):
+    """Return the number of a PMCID without its version, or None if it
+    isn't valid."""
+    if not pmcid or not pmcid.upper().startswith('PMC'):
+        return None
+    try:
+        return int(pmcid[3:].split('.', maxsplit=1)[0])
+    except ValueError:
+        return None
+
+
+def _get_doi_parts(doi):
+    """Return the namespace number and the ID of an upper case DOI, or
+    (None, None) if it isn't valid."""
+    if not doi:
+        return None, None
+    doi = doi.upper()
+    for prefix in ('HTTPS://', 'HTTP://', 'DX.DOI.ORG/', 'DOI.ORG/',
+                   'DOI:'):
+        if doi.startswith(prefix):
+            doi = doi[len(prefix):]
+    if not doi.startswith('10.') or '/' not in doi:
+        return None, None
+    doi_ns, doi_id = doi[3:].split('/', maxsplit=1)
+    try:
+        return int(doi_ns), doi_id
+    except ValueError:
+        return None, None
+
+
+def get_normalized_ids(pmid, pmcid, doi):
+    """Return the normalized identifiers that TextRefs are matched on.
+
+    Parameters
+    ----------
+    pmid : str or None
+        The PMID of an article.
+    pmcid : str or None
+        The PMCID of an article, with or without a version.
+    doi : str or None
+        The DOI of an article, in any case and optionally as a URL.
+
+    Returns
+    -------
+    tuple
+        The PMID number, the PMCID number, the DOI namespace number and the
+        upper case DOI ID, with None for missing or invalid identifiers.
+    """
+    return (_get_pmid_num(pmid), _get_pmcid_num(pmcid)) + _get_doi_parts(doi)
+
+
+def create_text_ref_table(conn):
+    """Create a local stand-in for the INDRA DB text_ref table.
+
+    The table has the identifier columns of the INDRA DB, with the same
+    indexes on the normalized identifiers. Use insert_text_refs to fill it.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        The connection to create the table in.
+    """
+    conn.execute('CREATE TABLE text_ref (id INTEGER PRIMARY KEY, %s, '
+                 'pmid_num INTEGER, pmcid_num INTEGER, doi_ns INTEGER, '
+                 'doi_id TEXT)'
+                 % ', '.join('%s TEXT' % col for col in text_ref_id_types))
+    for name, cols in (('pmid_num', 'pmid_num'), ('pmcid_num', 'pmcid_num'),
+                       ('doi', 'doi_ns, doi_id')):
+        conn.execute('CREATE INDEX text_ref_%s_idx ON text_ref (%s)'
+                     % (name, cols))
+    conn.commit()
+
+
+def insert_text_refs(conn, text_refs):
+    """Insert TextRefs into a table created with create_text_ref_table.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        The connection to the table.
+    text_refs : iterable of dict
+        TextRef dictionaries with the TRID and upper-case identifier types,
+        as returned by iter_text_refs_for_ids.
+    """
+    rows = []
+    for tr in text_refs:
+        ids = [tr.get(id_type.upper()) for id_type in text_ref_id_types]
+        rows.append([tr['TRID']] + ids +
+                    list(get_normalized_ids(tr.get('PMID'), tr.get('PMCID'),
+                                            tr.get('DOI'))))
+    conn.executemany('INSERT INTO text_ref (id, %s, pmid_num, pmcid_num, '
+                     'doi_ns, doi_id) VALUES (%s)'
+                     % (', '.join(text_ref_id_types),
+                        ', '.join('?' * (len(text_ref_id_types) + 5))),
+                     rows)
+    conn.commit()
+
+
+def _load_id_table(conn, cursor, id_triples):
+    cursor.execute('CREATE TEMPORARY TABLE cord_ids (pmid_num BIGINT, '
+                   'pmcid_num BIGINT, doi_ns INTEGER, doi_id TEXT)')
+    rows = (get_normalized_ids(*triple) for triple in id_triples)
+    if _is_sqlite(conn):
+        cursor.executemany('INSERT INTO cord_ids VALUES (?, ?, ?, ?)', rows)
+        return
+    # On Postgres, stream the identifiers with COPY
+    buf = io.StringIO()
+    for row in rows:
+        buf.write('\t'.join(r'\N' if val is None else
+                            str(val).replace('\\', '\\\\')
+                            .replace('\t', ' ')
+                            for val in row))
+        buf.write('\n')
+    buf.seek(0)
+    cursor.copy_expert('COPY cord_ids FROM STDIN', buf)
+
+
+def get_max_text_ref_id(conn):
+    """Return the largest TextRef ID in the DB, or None if there are none.
+
+    TextRef IDs increase monotonically, so this changes whenever TextRefs
+    are added to the DB.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT max(id) FROM text_ref')
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+
+def iter_text_refs_for_ids(conn, id_triples, fetch_size=10000, min_id=None):
+    """Iterate over TextRef dictionaries matching CORD19 identifiers.
+
+    Parameters
+    ----------
+    conn : DB-API connection
+        A (raw) connection to the INDRA DB, or to a local SQLite stand-in
+        with a text_ref table.
+    id_triples : iterable of tuple
+        (PMID, PMCID, DOI) tuples of the articles, with None for missing
+        identifiers.
+    fetch_size : Optional[int]
+        The number of rows fetched from the database at a time.
+        Default: 10000
+    min_id : Optional[int]
+        If given, only TextRefs with an ID larger than this are returned,
+        e.g. to find TextRefs added since a given state of the DB.
+        Default: None
+
+    Yields
+    ------
+    dict
+        Unique TextRef dictionaries as returned by TextRef.get_ref_dict, with
+        the TRID and the upper-case identifier types that are set.
+    """
+    cursor = conn.cursor()
+    _load_id_table(conn, cursor, id_triples)
+    cols = ', '.join('tr.%s' % col for col in text_ref_id_types)
+    query = ('SELECT tr.id, %s FROM text_ref tr WHERE tr.id IN ('
+             'SELECT tr.id FROM text_ref tr '
+             'JOIN cord_ids c ON tr.pmcid_num = c.pmcid_num '
+             'UNION SELECT tr.id FROM text_ref tr '
+             'JOIN cord_ids c ON tr.pmid_num = c.pmid_num '
+             'UNION SELECT tr.id FROM text_ref tr '
+             'JOIN cord_ids c ON tr.doi_ns = c.doi_ns '
+             'AND tr.doi_id = c.doi_id)' % cols)
+    if min_id is not None:
+        query += ' AND tr.id > %d' % min_id
+    if _is_sqlite(conn):
+        result_cursor = conn.cursor()
+    else:
+        # A named cursor is a server-side cursor in psycopg2
+        result_cursor = conn.cursor(name='cord_text_refs')
+    try:
+        result_cursor.execute(query)
+        while True:
+            rows = result_cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            for row in rows:
+                ref_dict = {id_type.upper(): val for id_type, val
+                            in zip(text_ref_id_types, row[1:]) if val}
+                ref_dict['TRID'] = row[0]
+                yield ref_dict
+    finally:
+        result_cursor.close()
+        cursor.execute('DROP TABLE cord_ids')
+        cursor.close()
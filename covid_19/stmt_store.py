@@ -0,0 +1,289 @@
+"""A compact statement file format with streaming and random access.
+
+A statement store holds INDRA Statement JSONs in compressed blocks with an
+index at the end of the file:
+
+- A header: the magic bytes INDRASTS, the format version, the codec
+  (0: zlib, 1: zstd) and the offset of the index, which is patched in when
+  the file is closed.
+- Blocks of up to block_size statements, each a little-endian uint32
+  length followed by compressed JSON lines, one statement JSON per line.
+- The index, a length-prefixed compressed JSON object with the offset and
+  number of statements of each block and the locations (block and position)
+  of the statements by statement hash.
+
+Statements can be written and read one block at a time, so neither needs
+the full list of statements in memory, and statements with a given hash are
+read by decompressing only their blocks. zstd is used if the zstandard
+package is installed, otherwise zlib.
+"""
+import os
+import json
+import zlib
+import struct
+import logging
+import importlib.util
+from indra.statements import stmts_from_json
+from indra.tools import assemble_corpus as ac
+
+
+logger = logging.getLogger(__name__)
+
+
+magic = b'INDRASTS'
+version = 1
+codecs = {'zlib': 0, 'zstd': 1}
+_header = struct.Struct('<8sBBQ')
+_length = struct.Struct('<I')
+
+
+def _get_compressor(codec, level=None):
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=level or 3).compress
+    return lambda data: zlib.compress(data, 1 if level is None else level)
+
+
+def _get_decompressor(codec):
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress
+    return zlib.decompress
+
+
+def get_default_codec():
+    """Return zstd if the zstandard package is available, otherwise zlib."""
+    return 'zstd' if importlib.util.find_spec('zstandard') else 'zlib'
+
+
+def is_store_file(path):
+    """Return True if the file at the given path is a statement store."""
+    with open(path, 'rb') as fh:
+        return fh.read(len(magic)) == magic
+
+
+class StatementStoreWriter(object):
+    """Write statements to a statement store file.
+
+    Parameters
+    ----------
+    path : str
+        The path of the file to write.
+    codec : Optional[str]
+        'zlib' or 'zstd'. Default: zstd if available, otherwise zlib
+    block_size : Optional[int]
+        The number of statements compressed together in a block. Larger
+        blocks compress better, smaller blocks make random access faster.
+        Default: 1000
+    level : Optional[int]
+        The compression level. Default: 1 for zlib, 3 for zstd, which
+        favor speed over size
+
+    The file is written to path + '.tmp' and only moved to path by close,
+    so an interrupted dump never leaves a store that looks complete. Used
+    as a context manager, the file is discarded if the block raises.
+    """
+    def __init__(self, path, codec=None, block_size=1000, level=None):
+        self.path = path
+        self.codec = codec or get_default_codec()
+        self.block_size = block_size
+        self._compress = _get_compressor(self.codec, level)
+        self._tmp_path = path + '.tmp'
+        self._fh = open(self._tmp_path, 'wb')
+        self._fh.write(_header.pack(magic, version, codecs[self.codec], 0))
+        self._block = []
+        self._block_hashes = []
+        self.blocks = []
+        self.locations = {}
+        self.count = 0
+
+    def write(self, stmt):
+        """Write a Statement, indexed by its hash."""
+        self.write_json(stmt.to_json(), stmt.get_hash())
+
+    def write_json(self, stmt_json, stmt_hash=None):
+        """Write a Statement JSON, indexed by stmt_hash if given."""
+        self._block.append(stmt_json)
+        self._block_hashes.append(stmt_hash)
+        if len(self._block) >= self.block_size:
+            self._flush_block()
+
+    def _flush_block(self):
+        if not self._block:
+            return
+        block_ix = len(self.blocks)
+        self.blocks.append((self._fh.tell(), len(self._block)))
+        self._write_record('\n'.join(json.dumps(stmt_json) for stmt_json
+                                      in self._block).encode('utf8'))
+        for pos, stmt_hash in enumerate(self._block_hashes):
+            if stmt_hash is not None:
+                self.locations.setdefault(str(stmt_hash), []).append(
+                    (block_ix, pos))
+        self.count += len(self._block)
+        self._block = []
+        self._block_hashes = []
+
+    def _write_record(self, data):
+        data = self._compress(data)
+        self._fh.write(_length.pack(len(data)))
+        self._fh.write(data)
+
+    def close(self):
+        """Write the index, close the file and move it to its path."""
+        if self._fh.closed:
+            return
+        try:
+            self._flush_block()
+            index_offset = self._fh.tell()
+            index = {'count': self.count, 'blocks': self.blocks,
+                     'locations': self.locations}
+            self._write_record(json.dumps(index).encode('utf8'))
+            self._fh.seek(0)
+            self._fh.write(_header.pack(magic, version, codecs[self.codec],
+                                        index_offset))
+        except BaseException:
+            self.abort()
+            raise
+        self._fh.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        """Close and remove the partially written file."""
+        if not self._fh.closed:
+            self._fh.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class StatementStore(object):
+    """Read statements from a statement store file.
+
+    Parameters
+    ----------
+    path : str
+        The path of the file to read.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._fh = open(path, 'rb')
+        file_magic, file_version, codec_id, index_offset = \
+            _header.unpack(self._fh.read(_header.size))
+        if file_magic != magic:
+            raise ValueError('%s is not a statement store' % path)
+        if file_version != version:
+            raise ValueError('Unsupported statement store version %d'
+                             % file_version)
+        if not index_offset:
+            raise ValueError('%s was not closed properly' % path)
+        self.codec = {v: k for k, v in codecs.items()}[codec_id]
+        self._decompress = _get_decompressor(self.codec)
+        index = json.loads(self._read_record(index_offset))
+        self.count = index['count']
+        self.blocks = index['blocks']
+        self.locations = index['locations']
+        # The last block read, which random access is likely to hit again
+        self._cached_block = (None, None)
+
+    def _read_record(self, offset):
+        self._fh.seek(offset)
+        length, = _length.unpack(self._fh.read(_length.size))
+        return self._decompress(self._fh.read(length))
+
+    def _read_block(self, block_ix):
+        # Return the lines of a block, only the requested lines are parsed
+        if self._cached_block[0] != block_ix:
+            lines = self._read_record(self.blocks[block_ix][0]).split(b'\n')
+            self._cached_block = (block_ix, lines)
+        return self._cached_block[1]
+
+    def _iter_blocks(self):
+        for offset, _ in self.blocks:
+            # Parse all the lines of a block in one go
+            yield json.loads(b'[' + self._read_record(offset).replace(
+                b'\n', b',') + b']')
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, stmt_hash):
+        return str(stmt_hash) in self.locations
+
+    def hashes(self):
+        """Return the statement hashes in the store, as ints."""
+        return [int(stmt_hash) for stmt_hash in self.locations]
+
+    def iter_json(self):
+        """Iterate over all Statement JSONs, one block at a time."""
+        for block in self._iter_blocks():
+            yield from block
+
+    def __iter__(self):
+        for block in self._iter_blocks():
+            yield from stmts_from_json(block)
+
+    def get_json(self, stmt_hash):
+        """Return the Statement JSONs with a given hash."""
+        return [json.loads(self._read_block(block_ix)[pos]) for block_ix, pos
+                in self.locations.get(str(stmt_hash), [])]
+
+    def get(self, stmt_hash):
+        """Return the Statements with a given hash."""
+        return stmts_from_json(self.get_json(stmt_hash))
+
+    def close(self):
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def dump_statements(stmts, path, **kwargs):
+    """Write a list of Statements to a statement store file.
+
+    Parameters
+    ----------
+    stmts : iterable of indra.statements.Statement
+        The statements to write.
+    path : str
+        The path of the file to write.
+    **kwargs
+        Passed to StatementStoreWriter, e.g. codec and block_size.
+    """
+    with StatementStoreWriter(path, **kwargs) as writer:
+        for stmt in stmts:
+            writer.write(stmt)
+    logger.info('Dumped %d statements into %s' % (writer.count, path))
+
+
+def load_statements(path):
+    """Load Statements from a statement store or a pickle file.
+
+    Parameters
+    ----------
+    path : str
+        The path of a statement store file, or of a pickle file as written
+        by indra.tools.assemble_corpus.dump_statements.
+
+    Returns
+    -------
+    list of indra.statements.Statement
+        The statements in the file.
+    """
+    if not is_store_file(path):
+        return ac.load_statements(path)
+    with StatementStore(path) as store:
+        stmts = list(store)
+    logger.info('Loaded %d statements from %s' % (len(stmts), path))
+    return stmts
@@ -0,0 +1,124 @@
+import random
+from covid_19 import add_to_indra_db
+from covid_19.add_to_indra_db import Cord19Manager, \
+    _filter_existing_tc_records
+
+
+sources = (('cord19_abstract', 'abstract'), ('cord19_pmc_xml', 'fulltext'),
+           ('cord19_pdf', 'fulltext'))
+
+
+def _old_filter(tc_records, existing_tc_records):
+    # The list based filter that _filter_existing_tc_records replaced
+    existing_tc_records = list(existing_tc_records)
+    filtered_tc_records = [
+        rec for rec in tc_records if rec[:-1] not in existing_tc_records
+    ]
+    return list(set(filtered_tc_records))
+
+
+def _get_records(n_records, seed):
+    rng = random.Random(seed)
+    tc_records = []
+    existing_tc_records = set()
+    for _ in range(n_records):
+        source, text_type = rng.choice(sources)
+        rec = (rng.randint(1, n_records // 2), source, 'text', text_type,
+               'content %d' % rng.randint(1, 3))
+        tc_records.append(rec)
+        if rng.random() < 0.5:
+            existing_tc_records.add(rec[:-1])
+    return tc_records, existing_tc_records
+
+
+def test_filter_existing_tc_records():
+    for seed in range(5):
+        tc_records, existing_tc_records = _get_records(500, seed)
+        assert sorted(_filter_existing_tc_records(tc_records,
+                                                  existing_tc_records)) == \
+            sorted(_old_filter(tc_records, existing_tc_records))
+
+
+class _Column(object):
+    def __init__(self, name):
+        self.name = name
+
+    def in_(self, values):
+        return lambda obj: getattr(obj, self.name) in set(values)
+
+    def __eq__(self, value):
+        return lambda obj: getattr(obj, self.name) == value
+
+
+class _Record(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def _id_in(id_type):
+    def id_in(ids, filter_ids=False):
+        return lambda tr: getattr(tr, id_type) in ids
+    return id_in
+
+
+class _TextRef(object):
+    pmid_in = staticmethod(_id_in('pmid'))
+    pmcid_in = staticmethod(_id_in('pmcid'))
+    doi_in = staticmethod(_id_in('doi'))
+
+
+class _TextContent(object):
+    text_ref_id = _Column('text_ref_id')
+    source = _Column('source')
+    format = _Column('format')
+    text_type = _Column('text_type')
+
+
+class _SqlExp(object):
+    @staticmethod
+    def or_(*clauses):
+        return lambda obj: any(clause(obj) for clause in clauses)
+
+
+class _DB(object):
+    TextRef = _TextRef
+    TextContent = _TextContent
+
+    def __init__(self, text_refs, text_content):
+        self.text_refs = text_refs
+        self.text_content = text_content
+
+    def select_all(self, table, *clauses):
+        rows = self.text_refs if table is _TextRef else self.text_content
+        return [row for row in rows
+                if all(clause(row) for clause in clauses)]
+
+
+def test_filter_text_content():
+    tc_records, existing_tc_records = _get_records(500, 0)
+    trids = {rec[0] for rec in tc_records}
+    text_refs = [_Record(id=trid, pmid=str(trid), pmcid=None, doi=None)
+                 for trid in trids]
+    # Content of other formats doesn't count as existing
+    text_content = [_Record(id=ix, text_ref_id=trid, source=source,
+                            format=fmt, text_type=text_type)
+                    for ix, (trid, source, fmt, text_type)
+                    in enumerate(existing_tc_records)] + \
+        [_Record(id=-1, text_ref_id=1, source='cord19_pdf', format='xml',
+                 text_type='fulltext')]
+    tc_data = [{'pmid': str(trid), 'pmcid': None, 'doi': None,
+                'cord_uid': 'uid%d' % trid, 'source': source, 'format': fmt,
+                'text_type': text_type, 'content': content}
+               for trid, source, fmt, text_type, content in tc_records]
+    cm = Cord19Manager([], load_content=False)
+    sql_exp = add_to_indra_db.sql_exp
+    add_to_indra_db.sql_exp = _SqlExp
+    try:
+        filtered_tc_records, flawed_tcs, tc_updates = \
+            cm.filter_text_content(_DB(text_refs, text_content), tc_data)
+    finally:
+        add_to_indra_db.sql_exp = sql_exp
+    assert not flawed_tcs
+    assert not tc_updates
+    assert sorted(filtered_tc_records) == \
+        sorted(_old_filter(tc_records, existing_tc_records))
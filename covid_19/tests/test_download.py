@@ -0,0 +1,135 @@
+import os
+import shutil
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from covid_19 import download
+from covid_19.download import download_file
+
+
+data = bytes(range(256)) * 40
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send_headers(self, status, length, content_range=None):
+        self.send_response(status)
+        self.send_header('Content-Length', str(length))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', self.server.etag)
+        if content_range:
+            self.send_header('Content-Range', content_range)
+        self.end_headers()
+
+    def do_HEAD(self):
+        self._send_headers(200, len(data))
+
+    def do_GET(self):
+        start, end = self.headers['Range'][len('bytes='):].split('-')
+        start, end = int(start), int(end)
+        self.server.requested.append((start, end))
+        if self.headers.get('If-Range') != self.server.etag:
+            self._send_headers(200, len(data))
+            self.wfile.write(data)
+            return
+        self._send_headers(206, end - start + 1,
+                           'bytes %d-%d/%d' % (start, end, len(data)))
+        # Close the connection part way through the first segment
+        if self.server.truncate_at is not None and start == 0:
+            self.wfile.write(data[start:self.server.truncate_at])
+            return
+        self.wfile.write(data[start:end + 1])
+
+
+class _Server(object):
+    def __enter__(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.etag = '"v1"'
+        self.server.requested = []
+        self.server.truncate_at = None
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.server.url = 'http://127.0.0.1:%d/file' % \
+            self.server.server_port
+        return self.server
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+def _download_truncated(server, path):
+    server.truncate_at = 1000
+    try:
+        download_file(server.url, path, n_segments=2, chunk_size=100)
+    except Exception:
+        pass
+    else:
+        assert False, 'The truncated download should fail'
+    assert not os.path.exists(path)
+    assert os.path.exists(path + '.part')
+    assert os.path.exists(path + '.part.json')
+    server.truncate_at = None
+    server.requested = []
+
+
+def test_resume_download():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'file.bin')
+        with _Server() as server:
+            _download_truncated(server, path)
+            download_file(server.url, path, n_segments=2, chunk_size=100)
+            # Only the rest of the first segment is downloaded again
+            assert server.requested == [(1000, len(data) // 2 - 1)]
+        with open(path, 'rb') as fh:
+            assert fh.read() == data
+        assert not os.path.exists(path + '.part')
+        assert not os.path.exists(path + '.part.json')
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_restart_changed_download():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'file.bin')
+        with _Server() as server:
+            _download_truncated(server, path)
+            # The remote file changed, so the whole file is downloaded again
+            server.etag = '"v2"'
+            download_file(server.url, path, n_segments=2, chunk_size=100)
+            assert sorted(server.requested) == \
+                [(0, len(data) // 2 - 1), (len(data) // 2, len(data) - 1)]
+        with open(path, 'rb') as fh:
+            assert fh.read() == data
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_state_interval():
+    tmp_dir = tempfile.mkdtemp()
+    dump_state = download._dump_state
+    states = []
+
+    def _dump_state(state_file, state):
+        states.append([segment[2] for segment in state['segments']])
+        dump_state(state_file, state)
+    download._dump_state = _dump_state
+    try:
+        path = os.path.join(tmp_dir, 'file.bin')
+        with _Server() as server:
+            download_file(server.url, path, n_segments=2, chunk_size=100,
+                          state_interval=4096)
+        with open(path, 'rb') as fh:
+            assert fh.read() == data
+        # The state is written when the download starts, once per segment
+        # after 4096 bytes, and when each segment ends
+        assert len(states) == 5
+        assert states[-1] == [len(data) // 2, len(data)]
+    finally:
+        download._dump_state = dump_state
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,29 @@
+from covid_19.benchmarks.group_grounded_stmts import get_stmts, \
+    group_two_pass
+from covid_19.emmaa_update import group_grounded_stmts
+
+
+def _hashes(by_tr, no_tr):
+    return ({tr: [stmt.get_hash(shallow=False) for stmt in stmt_list]
+             for tr, stmt_list in by_tr.items()},
+            [stmt.get_hash(shallow=False) for stmt in no_tr])
+
+
+def test_group_grounded_stmts():
+    stmts = get_stmts(500, 50)
+    by_tr, no_tr = group_two_pass(stmts)
+    assert by_tr and no_tr
+    for chunk_size in (1, 7, 1000):
+        res_by_tr, res_no_tr = group_grounded_stmts(iter(stmts),
+                                                    chunk_size=chunk_size)
+        # The same statements in the same order
+        assert list(res_by_tr) == list(by_tr)
+        assert all([id(s) for s in res_by_tr[tr]] ==
+                   [id(s) for s in by_tr[tr]] for tr in by_tr)
+        assert [id(s) for s in res_no_tr] == [id(s) for s in no_tr]
+
+
+def test_group_grounded_stmts_n_proc():
+    stmts = get_stmts(500, 50)
+    res = group_grounded_stmts(stmts, n_proc=2, chunk_size=50)
+    assert _hashes(*res) == _hashes(*group_two_pass(stmts))
@@ -0,0 +1,46 @@
+from covid_19.get_indra_stmts import cord19_metadata_for_trs, ConflictReport
+
+
+def _entry(cord_uid, doi=None, pmcid=None, pubmed_id=None):
+    return {'cord_uid': cord_uid, 'doi': doi, 'pmcid': pmcid,
+            'pubmed_id': pubmed_id}
+
+
+def test_single_trid():
+    trs = [{'TRID': 1, 'DOI': '10.1000/ABC', 'PMID': '123'}]
+    md = [_entry('u1', doi='http://dx.doi.org/10.1000/abc',
+                 pmcid='PMC1', pubmed_id='123')]
+    tr_dicts, multiple_tr_ids = cord19_metadata_for_trs(trs, md)
+    assert multiple_tr_ids == []
+    # IDs from the DB are preferred, missing ones are added from CORD19
+    assert tr_dicts == {1: {'TRID': 1, 'DOI': '10.1000/ABC', 'PMID': '123',
+                            'PMCID': 'PMC1', 'CORD19_UID': 'u1'}}
+    # The input dicts aren't modified
+    assert trs == [{'TRID': 1, 'DOI': '10.1000/ABC', 'PMID': '123'}]
+
+
+def test_multiple_trids():
+    # The entry matches one TextRef by DOI and another one by PMID. Each
+    # TextRef gets the CORD19 IDs it doesn't have itself, regardless of the
+    # order they are updated in.
+    trs = [{'TRID': 1, 'DOI': '10.1000/ABC'},
+           {'TRID': 2, 'PMID': '123'}]
+    md = [_entry('u1', doi='10.1000/abc', pmcid='PMC1', pubmed_id='123')]
+    report = ConflictReport()
+    tr_dicts, multiple_tr_ids = cord19_metadata_for_trs(trs, md, report)
+    assert multiple_tr_ids == [{1, 2}]
+    assert report.counts == {'multiple_trids': 1}
+    assert tr_dicts == {
+        1: {'TRID': 1, 'DOI': '10.1000/ABC', 'PMID': '123', 'PMCID': 'PMC1',
+            'CORD19_UID': 'u1'},
+        2: {'TRID': 2, 'DOI': '10.1000/abc', 'PMID': '123', 'PMCID': 'PMC1',
+            'CORD19_UID': 'u1'}}
+
+
+def test_mismatch():
+    trs = [{'TRID': 1, 'DOI': '10.1000/ABC', 'PMID': '456'}]
+    md = [_entry('u1', doi='10.1000/abc', pubmed_id='123')]
+    report = ConflictReport()
+    tr_dicts, _ = cord19_metadata_for_trs(trs, md, report)
+    assert report.counts == {'mismatch': 1}
+    assert tr_dicts[1]['PMID'] == '456'
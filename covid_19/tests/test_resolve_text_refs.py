@@ -0,0 +1,76 @@
+import sqlite3
+from covid_19.resolve_text_refs import create_text_ref_table, \
+    insert_text_refs, iter_text_refs_for_ids, get_max_text_ref_id
+
+
+text_refs = [
+    {'TRID': 1, 'PMID': '11'},
+    {'TRID': 2, 'PMCID': 'PMC22'},
+    {'TRID': 3, 'DOI': '10.1000/ABC.D'},
+    {'TRID': 4, 'PMID': '44', 'PMCID': 'PMC44', 'DOI': '10.1000/XYZ'},
+    {'TRID': 5, 'PMID': '55'},
+    {'TRID': 6, 'DOI': '10.2000/OTHER'},
+]
+
+
+def _get_conn():
+    conn = sqlite3.connect(':memory:')
+    create_text_ref_table(conn)
+    insert_text_refs(conn, text_refs)
+    return conn
+
+
+def _get_trids(conn, id_triples, **kwargs):
+    trids = [tr['TRID'] for tr
+             in iter_text_refs_for_ids(conn, id_triples, **kwargs)]
+    # Each TextRef is returned once
+    assert len(trids) == len(set(trids))
+    return set(trids)
+
+
+def test_mixed_ids():
+    conn = _get_conn()
+    id_triples = [('11', None, None), (None, 'PMC22', None),
+                  (None, None, '10.1000/ABC.D'),
+                  # All three identifiers of the same TextRef
+                  ('44', 'PMC44', '10.1000/XYZ'),
+                  # No matching TextRef
+                  ('99', 'PMC99', '10.9/NONE'), (None, None, None)]
+    assert _get_trids(conn, id_triples) == {1, 2, 3, 4}
+    ref_dict = [tr for tr in iter_text_refs_for_ids(conn, id_triples)
+                if tr['TRID'] == 4][0]
+    assert ref_dict == text_refs[3]
+
+
+def test_normalized_ids():
+    conn = _get_conn()
+    # PMIDs with leading zeros, PMCIDs with versions and in lower case
+    assert _get_trids(conn, [('011', None, None)]) == {1}
+    assert _get_trids(conn, [(None, 'PMC22.2', None)]) == {2}
+    assert _get_trids(conn, [(None, 'pmc44', None)]) == {4}
+    # DOIs in lower case and with a prefix or as URLs
+    for doi in ('10.1000/abc.d', 'doi:10.1000/abc.d',
+                'https://doi.org/10.1000/abc.d',
+                'http://dx.doi.org/10.1000/ABC.D'):
+        assert _get_trids(conn, [(None, None, doi)]) == {3}, doi
+    # Invalid identifiers don't match anything
+    assert not _get_trids(conn, [('PMID11', '22', 'abc.d')])
+
+
+def test_paging():
+    conn = _get_conn()
+    id_triples = [('11', None, None), (None, 'PMC22', None),
+                  (None, None, '10.1000/abc.d'), ('44', None, None),
+                  ('55', None, None), (None, None, '10.2000/other')]
+    assert get_max_text_ref_id(conn) == 6
+    for fetch_size in (1, 4, 100):
+        assert _get_trids(conn, id_triples, fetch_size=fetch_size) == \
+            {1, 2, 3, 4, 5, 6}
+        # Only TextRefs added after a given ID
+        assert _get_trids(conn, id_triples, fetch_size=fetch_size,
+                          min_id=3) == {4, 5, 6}
+    assert not _get_trids(conn, id_triples, min_id=6)
+    # The temporary table is dropped, so the connection can be reused
+    insert_text_refs(conn, [{'TRID': 7, 'PMID': '77'}])
+    assert _get_trids(conn, [('77', None, None)],
+                      min_id=get_max_text_ref_id(conn) - 1) == {7}
@@ -0,0 +1,109 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+from covid_19 import text_ref_cache
+from covid_19.text_ref_cache import resolve_ids, cache_version
+from covid_19.resolve_text_refs import create_text_ref_table, \
+    insert_text_refs, get_max_text_ref_id
+
+
+class _Engine(object):
+    def __init__(self, fname):
+        self.fname = fname
+        self.n_connections = 0
+
+    def raw_connection(self):
+        self.n_connections += 1
+        return sqlite3.connect(self.fname)
+
+
+class _DB(object):
+    def __init__(self, fname):
+        self.engine = _Engine(fname)
+
+
+class _LocalDB(object):
+    """Use an SQLite stand-in for the INDRA DB in text_ref_cache."""
+    def __enter__(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db = _DB(os.path.join(self.tmp_dir, 'db.sqlite'))
+        self.conn = sqlite3.connect(self.db.engine.fname)
+        create_text_ref_table(self.conn)
+        self.get_db = text_ref_cache.get_db
+        text_ref_cache.get_db = lambda name: self.db
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        text_ref_cache.get_db = self.get_db
+        self.conn.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def add(self, text_refs):
+        insert_text_refs(self.conn, text_refs)
+        return get_max_text_ref_id(self.conn)
+
+    @property
+    def n_connections(self):
+        return self.db.engine.n_connections
+
+
+def _get_trids(cache, id_triples):
+    return {trid for triple in id_triples
+            for key in text_ref_cache._id_keys(triple)
+            for trid in cache['resolved'].get(key, [])}
+
+
+def test_cache_hit():
+    with _LocalDB() as db:
+        db_state = db.add([{'TRID': 1, 'PMID': '11',
+                            'DOI': '10.1000/ABC'},
+                           {'TRID': 2, 'PMCID': 'PMC22'}])
+        cache = {'version': cache_version, 'resolved': {}, 'text_refs': {}}
+        # Identifiers in another form than in the DB
+        id_triples = {(None, None, 'https://doi.org/10.1000/abc'),
+                      ('011', None, None), (None, 'pmc22.1', None)}
+        resolve_ids(id_triples, cache, db_state)
+        assert db.n_connections == 1
+        assert _get_trids(cache, id_triples) == {1, 2}
+        assert set(cache['text_refs']) == {1, 2}
+        # The same identifiers are resolved from the cache, also in the
+        # form of the DB
+        id_triples |= {('11', None, '10.1000/ABC'), (None, 'PMC22', None)}
+        resolve_ids(id_triples, cache, db_state)
+        assert db.n_connections == 1
+        assert _get_trids(cache, id_triples) == {1, 2}
+
+
+def test_cache_miss():
+    with _LocalDB() as db:
+        db_state = db.add([{'TRID': 1, 'PMID': '11'}])
+        cache = {'version': cache_version, 'resolved': {}, 'text_refs': {}}
+        id_triples = {('11', None, None), ('33', None, None)}
+        resolve_ids(id_triples, cache, db_state)
+        assert db.n_connections == 1
+        # Identifiers without a TextRef aren't cached and are looked up again
+        assert set(cache['resolved']) == {'PMID:11'}
+        resolve_ids(id_triples, cache, db_state)
+        assert db.n_connections == 2
+        assert _get_trids(cache, id_triples) == {1}
+
+
+def test_cache_invalidation():
+    with _LocalDB() as db:
+        db_state = db.add([{'TRID': 1, 'DOI': '10.1000/ABC'}])
+        cache = {'version': cache_version, 'resolved': {}, 'text_refs': {}}
+        id_triples = {(None, None, '10.1000/abc')}
+        resolve_ids(id_triples, cache, db_state)
+        assert _get_trids(cache, id_triples) == {1}
+        # Another TextRef with the DOI of a resolved article is added
+        new_db_state = db.add([{'TRID': 2, 'DOI': 'doi:10.1000/abc'}])
+        assert new_db_state != db_state
+        # The cache is used as long as the DB state is the same
+        resolve_ids(id_triples, cache, db_state)
+        assert db.n_connections == 1
+        assert _get_trids(cache, id_triples) == {1}
+        resolve_ids(id_triples, cache, new_db_state)
+        assert db.n_connections == 2
+        assert _get_trids(cache, id_triples) == {1, 2}
+        assert cache['db_state'] == new_db_state
@@ -0,0 +1,207 @@
+"""An on-disk cache of the mapping of CORD19 identifiers to INDRA DB TextRefs.
+
+The cache of a release stores which TextRef IDs each PMID, PMCID and DOI
+resolved to, the TextRef dictionaries themselves and the aligned tr_dicts
+returned by get_tr_dicts_and_ids. When a new release is processed, the
+cache of the latest earlier release is reused and only identifiers not
+resolved before are looked up in the DB.
+
+A cache records the state of the DB it was built against, the largest
+TextRef ID. If TextRefs were added to the DB since, the cached tr_dicts are
+rebuilt and resolved identifiers are matched against the new TextRefs.
+Identifiers without a TextRef are never cached.
+
+Identifiers are cached in the normalized form from get_normalized_ids that
+TextRefs are matched on in the DB, so that e.g. a DOI in lower case or with
+a URL prefix has the same cache entry as the upper case DOI of its TextRef.
+"""
+import os
+import gzip
+import json
+import logging
+from os.path import join
+from indra_db.util import get_db
+from covid_19.preprocess import data_dir, get_release_date, \
+    get_text_refs_for_entries, text_ref_mappings
+from covid_19.metadata import get_metadata_table
+from covid_19.resolve_text_refs import get_max_text_ref_id, \
+    get_normalized_ids, iter_text_refs_for_ids
+
+
+logger = logging.getLogger(__name__)
+
+
+# The version of the cache format, caches of other versions are rebuilt
+cache_version = 2
+
+
+def get_cache_file(date):
+    """Return the path to the TextRef cache of a given release."""
+    return join(data_dir, date, 'text_ref_cache.json.gz')
+
+
+def load_cache(date):
+    """Return the TextRef cache of a release, or None if there isn't one
+    of the current version."""
+    fname = get_cache_file(date)
+    if not os.path.exists(fname):
+        return None
+    with gzip.open(fname, 'rt') as fh:
+        cache = json.load(fh)
+    if cache.get('version') != cache_version:
+        logger.info('Ignoring the TextRef cache in %s of an earlier version'
+                    % fname)
+        return None
+    # JSON keys are strings, TRIDs are ints
+    cache['text_refs'] = {int(trid): tr for trid, tr
+                          in cache['text_refs'].items()}
+    if cache.get('tr_dicts') is not None:
+        cache['tr_dicts'] = {int(trid): tr for trid, tr
+                             in cache['tr_dicts'].items()}
+    return cache
+
+
+def save_cache(date, cache):
+    """Save the TextRef cache of a release."""
+    fname = get_cache_file(date)
+    tmp_fname = fname + '.tmp'
+    with gzip.open(tmp_fname, 'wt') as fh:
+        json.dump(cache, fh)
+    os.replace(tmp_fname, fname)
+
+
+def _get_previous_cache(date):
+    if not os.path.exists(data_dir):
+        return None
+    earlier = sorted(d for d in os.listdir(data_dir)
+                     if d < date and os.path.exists(get_cache_file(d)))
+    return load_cache(earlier[-1]) if earlier else None
+
+
+def _id_keys(id_triple):
+    # Keys of the normalized identifiers, as matched in the DB
+    pmid_num, pmcid_num, doi_ns, doi_id = get_normalized_ids(*id_triple)
+    keys = []
+    if pmid_num is not None:
+        keys.append('PMID:%d' % pmid_num)
+    if pmcid_num is not None:
+        keys.append('PMCID:%d' % pmcid_num)
+    if doi_ns is not None:
+        keys.append('DOI:%d/%s' % (doi_ns, doi_id))
+    return keys
+
+
+def get_db_state():
+    """Return the state of the DB that a cache is valid for, the largest
+    TextRef ID."""
+    db = get_db('primary')
+    conn = db.engine.raw_connection()
+    try:
+        return get_max_text_ref_id(conn)
+    finally:
+        conn.close()
+
+
+def _add_text_refs(cache, text_refs, keys):
+    resolved = cache['resolved']
+    for tr in text_refs:
+        cache['text_refs'][tr['TRID']] = tr
+        for key in _id_keys((tr.get('PMID'), tr.get('PMCID'),
+                             tr.get('DOI'))):
+            if key in keys:
+                resolved.setdefault(key, [])
+                if tr['TRID'] not in resolved[key]:
+                    resolved[key].append(tr['TRID'])
+
+
+def resolve_ids(id_triples, cache, db_state):
+    """Update a cache with the TextRefs of identifiers not resolved before.
+
+    Identifiers without a TextRef aren't stored, so they are looked up again
+    every time in case their TextRef was added to the DB since. If the DB
+    changed since the cache was built, identifiers resolved before are also
+    matched against the TextRefs added since.
+
+    Parameters
+    ----------
+    id_triples : set of tuple
+        (PMID, PMCID, DOI) tuples of CORD19 articles.
+    cache : dict
+        The cache to update, with the resolved identifiers under 'resolved',
+        TextRef dictionaries by TRID under 'text_refs' and the DB state it
+        was built against under 'db_state'.
+    db_state : int
+        The current state of the DB from get_db_state.
+    """
+    resolved = cache['resolved']
+    unseen = {triple for triple in id_triples
+              if any(key not in resolved for key in _id_keys(triple))}
+    # TextRefs with IDs up to the cached state were already matched against
+    # the resolved identifiers
+    seen = id_triples - unseen if cache.get('db_state') != db_state \
+        else set()
+    logger.info('Looking up TextRefs for %d of %d articles with identifiers '
+                'not in the cache, and new TextRefs for %d articles'
+                % (len(unseen), len(id_triples), len(seen)))
+    if unseen or seen:
+        db = get_db('primary')
+        conn = db.engine.raw_connection()
+        try:
+            if unseen:
+                _add_text_refs(cache, iter_text_refs_for_ids(conn, unseen),
+                               {key for triple in unseen
+                                for key in _id_keys(triple)})
+            if seen:
+                _add_text_refs(cache, iter_text_refs_for_ids(
+                    conn, seen, min_id=cache.get('db_state')),
+                    {key for triple in seen for key in _id_keys(triple)})
+        finally:
+            conn.close()
+    cache['db_state'] = db_state
+
+
+def get_cached_tr_dicts_and_ids(refresh=False):
+    """Return tr_dicts and multiple_tr_ids, using the TextRef cache.
+
+    Parameters
+    ----------
+    refresh : Optional[bool]
+        If True, ignore existing caches and look up all identifiers in the
+        DB. Default: False
+
+    Returns
+    -------
+    tr_dicts : dict
+        TextRef dictionaries aligned with CORD19 metadata, keyed by TRID.
+    multiple_tr_ids : list of set
+        Sets of TRIDs that a single CORD19 article mapped to.
+    """
+    # Import here to avoid a circular import
+    from covid_19.get_indra_stmts import cord19_metadata_for_trs
+    date = get_release_date()
+    db_state = get_db_state()
+    cache = None if refresh else load_cache(date)
+    # The aligned tr_dicts are only reused if the DB hasn't changed since
+    if cache is not None and cache.get('tr_dicts') is not None \
+            and cache.get('db_state') == db_state:
+        logger.info('Loaded TextRefs for release %s from the cache' % date)
+        return cache['tr_dicts'], [set(trids) for trids
+                                   in cache['multiple_tr_ids']]
+    if cache is None and not refresh:
+        cache = _get_previous_cache(date)
+    if cache is None:
+        cache = {'version': cache_version, 'resolved': {}, 'text_refs': {}}
+    md = get_metadata_table(columns=list(text_ref_mappings))
+    text_refs = get_text_refs_for_entries(md)
+    id_triples = {(tr.get('PMID'), tr.get('PMCID'), tr.get('DOI'))
+                  for tr in text_refs}
+    resolve_ids(id_triples, cache, db_state)
+    trids = {trid for triple in id_triples for key in _id_keys(triple)
+             for trid in cache['resolved'].get(key, [])}
+    # Copy the TextRef dicts since they are updated with the metadata
+    tr_dicts, multiple_tr_ids = cord19_metadata_for_trs(
+        [dict(cache['text_refs'][trid]) for trid in trids], md)
+    cache['tr_dicts'] = tr_dicts
+    cache['multiple_tr_ids'] = [sorted(trids) for trids in multiple_tr_ids]
+    save_cache(date, cache)
+    return tr_dicts, multiple_tr_ids